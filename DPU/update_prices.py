@@ -1,5 +1,11 @@
+import argparse
+import io
+import resource
+import time
 import yfinance as yf
-from datetime import datetime
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
 from psycopg2 import pool
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -52,81 +58,316 @@ def get_all_tickers():
             return tickers
 
 
-def update_all_prices(current_day_only=False):
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+
+# Same ingestion path as database.copy_prices in the backend
+def copy_prices(cur, frame):
+    """
+    Upsert rows into prices in bulk. frame has the columns symbol, date and PRICE_COLUMNS.
+    The rows are streamed into a staging table with COPY and merged with a single
+    INSERT ... ON CONFLICT. Returns the number of rows merged.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS prices_staging (
+            symbol TEXT,
+            date DATE,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION,
+            adj_close DOUBLE PRECISION,
+            volume BIGINT
+        ) ON COMMIT DELETE ROWS
+    """)
+
+    buffer = io.StringIO()
+    frame[['symbol', 'date'] + PRICE_COLUMNS].to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d')
+    buffer.seek(0)
+    cur.copy_expert("""
+        COPY prices_staging (symbol, date, open, high, low, close, adj_close, volume)
+        FROM STDIN WITH (FORMAT csv)
+    """, buffer)
+
+    # DISTINCT ON keeps a duplicated (symbol, date) from hitting the same row twice
+    cur.execute("""
+        INSERT INTO prices (symbol, date, open, high, low, close, adj_close, volume)
+        SELECT DISTINCT ON (symbol, date) symbol, date, open, high, low, close, adj_close, volume
+        FROM prices_staging
+        ORDER BY symbol, date
+        ON CONFLICT (symbol, date) DO UPDATE
+        SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+            close = EXCLUDED.close, adj_close = EXCLUDED.adj_close, volume = EXCLUDED.volume
+    """)
+    rows = cur.rowcount
+    if rows:
+        bump_price_data_version(cur)
+    return rows
+
+# Same as database.bump_price_data_version; the backend's result cache watches this
+def bump_price_data_version(cur):
+    """Mark the prices as changed, invalidating anything cached against the old version"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS price_data_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """)
+    cur.execute("""
+        INSERT INTO price_data_version (id, version, updated_at)
+        VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE
+        SET version = price_data_version.version + 1, updated_at = NOW()
+    """)
+
+def price_frame(ticker, ticker_data):
+    """Flatten one ticker's slice of a yfinance download into copy_prices' format"""
+    frame = ticker_data.rename(columns={"Open": "open", "High": "high", "Low": "low", "Close": "close", "Adj Close": "adj_close", "Volume": "volume"})
+    frame = frame[PRICE_COLUMNS].copy()
+    frame['volume'] = frame['volume'].round().astype('Int64')
+    frame.insert(0, 'date', frame.index)
+    frame.insert(0, 'symbol', ticker)
+    return frame
+
+# symbols downloaded and committed together; bounds memory whatever the universe size
+DOWNLOAD_BATCH_SIZE = int(os.getenv('DOWNLOAD_BATCH_SIZE', '100'))
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def yahoo_fetcher(tickers, start=None):
+    """Download tickers from start (their whole history if None) as {ticker: frame with yfinance's columns}"""
+    tickers_data = yf.download(",".join(tickers), start=start)
+    frames = {}
+    for ticker in tickers:
+        # Access multi-index DataFrame correctly by selecting all price types for this ticker
+        try:
+            frames[ticker] = tickers_data.xs(ticker, axis=1, level=1)
+        except KeyError:
+            continue
+    return frames
+
+def csv_fetcher(directory):
+    """
+    A stand-in for yahoo_fetcher that reads <directory>/<ticker>.csv, with a date column
+    and yfinance's column names, so updates can run offline
+    """
+    def fetch(tickers, start=None):
+        frames = {}
+        for ticker in tickers:
+            path = os.path.join(directory, f"{ticker}.csv")
+            if not os.path.exists(path):
+                continue
+            frame = pd.read_csv(path, index_col=0, parse_dates=True)
+            if start is not None:
+                frame = frame[frame.index >= pd.Timestamp(start)]
+            frames[ticker] = frame
+        return frames
+    return fetch
+
+def create_high_water_marks(cur):
+    """The last ingested date per symbol, so updates only fetch what is missing"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS price_high_water_marks (
+            symbol TEXT PRIMARY KEY,
+            last_date DATE NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """)
+
+def get_high_water_marks(cur, tickers):
+    """{ticker: last ingested date} for the tickers that have been ingested before"""
+    create_high_water_marks(cur)
+    # symbols ingested before the marks existed start from their last row in prices
+    cur.execute("""
+        INSERT INTO price_high_water_marks (symbol, last_date, updated_at)
+        SELECT symbol, MAX(date), NOW()
+        FROM prices
+        WHERE symbol = ANY(%s)
+        AND symbol NOT IN (SELECT symbol FROM price_high_water_marks)
+        GROUP BY symbol
+    """, (tickers,))
+    cur.execute("""
+        SELECT symbol, last_date FROM price_high_water_marks WHERE symbol = ANY(%s)
+    """, (tickers,))
+    return dict(cur.fetchall())
+
+def set_high_water_marks(cur, marks):
+    cur.executemany("""
+        INSERT INTO price_high_water_marks (symbol, last_date, updated_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT (symbol) DO UPDATE
+        SET last_date = GREATEST(price_high_water_marks.last_date, EXCLUDED.last_date), updated_at = NOW()
+    """, list(marks.items()))
+
+# When set, every update is also merged into memory-mappable price files here, which the
+# backend reads with PRICE_BACKEND=files. Same layout as price_files.py in the backend
+PRICE_FILES_DIR = os.getenv('PRICE_FILES_DIR')
+
+def _price_file_path(symbol, part):
+    return os.path.join(PRICE_FILES_DIR, f"{symbol.replace('/', '_')}.{part}.npy")
+
+def price_history(cur, tickers):
+    """{ticker: price_frame-shaped frame} of every row in prices for tickers"""
+    cur.execute(f"""
+        SELECT symbol, date, {', '.join(PRICE_COLUMNS)}
+        FROM prices
+        WHERE symbol = ANY(%s)
+        ORDER BY symbol, date
+    """, (list(tickers),))
+    rows = pd.DataFrame(cur.fetchall(), columns=['symbol', 'date'] + PRICE_COLUMNS)
+    rows['date'] = pd.to_datetime(rows['date'])
+    rows[PRICE_COLUMNS] = rows[PRICE_COLUMNS].astype(np.float64)
+    return {ticker: frame.reset_index(drop=True) for ticker, frame in rows.groupby('symbol', sort=False)}
+
+def write_price_files(frames):
+    """Merge {ticker: price_frame} into the price files, then bump their VERSION"""
+    os.makedirs(PRICE_FILES_DIR, exist_ok=True)
+    for ticker, frame in frames.items():
+        dates = frame['date'].to_numpy(dtype='datetime64[ns]')
+        values = frame[PRICE_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+        if os.path.exists(_price_file_path(ticker, 'dates')):
+            # new bars replace any stored on the same dates
+            old_dates = np.load(_price_file_path(ticker, 'dates'))
+            old_values = np.load(_price_file_path(ticker, 'values'))
+            keep = ~np.isin(old_dates, dates)
+            dates = np.concatenate([old_dates[keep], dates])
+            values = np.concatenate([old_values[keep], values])
+            order = np.argsort(dates, kind='stable')
+            dates, values = dates[order], values[order]
+        # values first and dates last, see price_files.read_price_file
+        for part, array in (('values', values), ('dates', dates)):
+            path = _price_file_path(ticker, part)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+
+    version_path = os.path.join(PRICE_FILES_DIR, 'VERSION')
+    version = 0
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            version = int(f.read().strip() or 0)
+    with open(version_path + '.tmp', 'w') as f:
+        f.write(str(version + 1))
+    os.replace(version_path + '.tmp', version_path)
+
+def save_frames(frames):
+    """Upsert {ticker: raw frame} with one COPY and move each ticker's high-water mark to its last bar"""
+    frames = {ticker: price_frame(ticker, frame) for ticker, frame in frames.items() if not frame.empty}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            rows = copy_prices(cur, pd.concat(frames.values())) if frames else 0
+            create_high_water_marks(cur)
+            set_high_water_marks(cur, {ticker: frame['date'].max().date() for ticker, frame in frames.items()})
+            if PRICE_FILES_DIR:
+                # an incremental update only brings the new bars, so a ticker without a price
+                # file yet gets its whole history, including what was just upserted
+                new = [ticker for ticker in frames if not os.path.exists(_price_file_path(ticker, 'dates'))]
+                if new:
+                    frames.update(price_history(cur, new))
+            conn.commit()
+    if PRICE_FILES_DIR and frames:
+        write_price_files(frames)
+    return rows
+
+def update_all_prices(current_day_only=False, fetcher=yahoo_fetcher):
     tickers = get_all_tickers()
     print(f"Updating data for {len(tickers)} symbols")
-    
-    tickers_string = ",".join(tickers)
+
     if current_day_only:
         current_date = datetime.now().strftime('%Y-%m-%d')
         print(f"Fetching data for current day: {current_date}")
-        tickers_data = yf.download(tickers_string, start=current_date)
     else:
+        current_date = None
         print("Fetching data for all days")
-        tickers_data = yf.download(tickers_string)
 
-    # Prepare batch data
-    batch_data = []
-    
-    for ticker in tickers:
-        # Access multi-index DataFrame correctly by selecting all price types for this ticker
-        ticker_data = tickers_data.xs(ticker, axis=1, level=1)
-        ticker_data = ticker_data.dropna()
-
-        # Process each date for this ticker
-        for date, row in ticker_data.iterrows():
-            batch_data.append({
-                'symbol': ticker,
-                'adj_close': float(row['Adj Close']),
-                'open': float(row['Open']),
-                'high': float(row['High']),
-                'low': float(row['Low']),
-                'close': float(row['Close']),
-                'volume': int(row['Volume']),
-                'date': date.strftime('%Y-%m-%d')
-            })
-
-    # Batch insert/update
+    start = time.time()
+    rows = 0
+    # Stream a chunk of tickers at a time into prices, one COPY and commit per chunk
+    for chunk in chunks(tickers, DOWNLOAD_BATCH_SIZE):
+        tickers_data = fetcher(chunk, start=current_date)
+        rows += save_frames({ticker: ticker_data.dropna() for ticker, ticker_data in tickers_data.items()})
+
+    elapsed = time.time() - start
+    print(f"Saved {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s, peak memory {peak_memory_mb():.0f} MB)")
+    print(f"Updated history for {len(tickers)} symbols")
+
+def update_incremental(fetcher=yahoo_fetcher):
+    """
+    Fetch only the bars after each symbol's high-water mark. Symbols with the same gap are
+    downloaded together, new symbols get their whole history, and only rows past the mark
+    are upserted.
+    """
+    start = time.time()
+    tickers = get_all_tickers()
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Using execute_values for bulk insert
-            from psycopg2.extras import execute_values
-            
-            query = """
-                INSERT INTO prices (symbol, date, open, high, low, close, adj_close, volume)
-                VALUES %s
-                ON CONFLICT (symbol, date) 
-                DO UPDATE SET
-                    open = EXCLUDED.open,
-                    high = EXCLUDED.high,
-                    low = EXCLUDED.low,
-                    close = EXCLUDED.close,
-                    adj_close = EXCLUDED.adj_close,
-                    volume = EXCLUDED.volume
-            """
-            
-            # Convert batch_data to tuples for execute_values
-            values = [(d['symbol'], d['date'], d['open'], d['high'], d['low'], 
-                      d['close'], d['adj_close'], d['volume']) for d in batch_data]
-            
-            execute_values(cur, query, values)
+            marks = get_high_water_marks(cur, tickers)
             conn.commit()
 
-    print(f"Updated history for {len(tickers)} symbols")
+    today = datetime.now().date()
+    groups = {} # first missing date, None for a new symbol: tickers
+    for ticker in tickers:
+        last_date = marks.get(ticker)
+        first_missing = None if last_date is None else last_date + timedelta(days=1)
+        if first_missing is not None and first_missing > today:
+            continue
+        groups.setdefault(first_missing, []).append(ticker)
+
+    due = sum(len(group) for group in groups.values())
+    print(f"{due} of {len(tickers)} symbols are behind, in {len(groups)} groups")
+
+    rows = 0
+    requests = 0
+    for first_missing, group in groups.items():
+        for batch in chunks(group, DOWNLOAD_BATCH_SIZE):
+            requests += 1
+            frames = {}
+            for ticker, ticker_data in fetcher(batch, start=first_missing).items():
+                ticker_data = ticker_data.dropna()
+                # the source may hand back bars we already have
+                if ticker in marks:
+                    ticker_data = ticker_data[ticker_data.index.date > marks[ticker]]
+                frames[ticker] = ticker_data
+            # committed per batch, so a failure later on keeps what was saved
+            rows += save_frames(frames)
+
+    elapsed = time.time() - start
+    print(f"Fetched {due} symbols in {requests} requests and saved {rows} new rows in {elapsed:.2f}s (peak memory {peak_memory_mb():.0f} MB)")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the prices table up to date")
+    parser.add_argument('--full', action='store_true', help="re-download every symbol's whole history instead of only the missing bars")
+    parser.add_argument('--csv', metavar='DIR', help="read bars from DIR/<symbol>.csv instead of Yahoo Finance")
+    parser.add_argument('--once', action='store_true', help="update once and exit instead of scheduling daily updates")
+    args = parser.parse_args()
+
+    fetcher = csv_fetcher(args.csv) if args.csv else yahoo_fetcher
+    if args.full:
+        update = lambda: update_all_prices(fetcher=fetcher)
+    else:
+        update = lambda: update_incremental(fetcher)
+
     # Run once immediately when starting
     logging.info("Running initial price update...")
-    update_all_prices(current_day_only=False)
-    
+    update()
+    if args.once:
+        raise SystemExit
+
     scheduler = BlockingScheduler()
+    # a missed day is picked up by the next incremental run
     scheduler.add_job(
-        update_all_prices,
+        update_incremental,
         'cron',
-        args=[True],  # Pass current_day_only=True
+        args=[fetcher],
         hour=18,  # 6 PM
         timezone=timezone('US/Eastern')
     )
-    
+
     logging.info("Starting scheduler. Price updates will run daily at 6 PM EST.")
     scheduler.start()
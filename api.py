@@ -1,13 +1,19 @@
+import asyncio
+import os
 import fastapi
 from fastapi.middleware.cors import CORSMiddleware
-from backtesting import Portfolio
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from datetime import datetime
-import numpy as np
-import math
-import pandas as pd
 import json
 from database import get_db_connection
+from execution import execution_options
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from jobs import JobManager, QueueFullError, WorkerPoolError, run_batch_job
+from result_cache import ResultCache
+from serialization import RESPONSE_LAYOUTS
+from trading_calendar import check_schedule
 
 app = fastapi.FastAPI()
 
@@ -20,110 +26,163 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (np.floating, float)):
-            if math.isnan(obj) or math.isinf(obj):
-                return None
-            return float(obj)
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, pd.Timestamp):
-            return obj.strftime('%Y-%m-%d')
-        return super().default(obj)
-
-def clean_data_for_json(df):
-    """Clean DataFrame to make it JSON serializable"""
-    records = []
-    for index, row in df.iterrows():
-        clean_row = {}
-        for column, value in row.items():
-            if isinstance(value, (np.floating, float)):
-                if math.isnan(value) or math.isinf(value):
-                    clean_row[column] = None
-                else:
-                    clean_row[column] = float(value)
-            elif isinstance(value, np.integer):
-                clean_row[column] = int(value)
-            else:
-                clean_row[column] = value
-        clean_row['date'] = index.strftime('%Y-%m-%d')
-        records.append(clean_row)
-    return records
-
-@app.post("/backtest")
-def backtest(payload: dict):
-    # start_date = payload["start_date"]
-    # end_date = payload["end_date"]
-    # starting_capital = payload["starting_capital"]
-    # monthly_investment = payload["monthly_investment"]
-    start_date = payload["start_date"]
-    end_date = payload["end_date"]
-    starting_capital = float(payload["starting_capital"])
-    monthly_investment = float(payload["monthly_investment"])
-    rules = payload
-    
-    # convert start and end date to datetime
-    start_date = datetime.strptime(start_date, "%Y-%m-%d")
-    end_date = datetime.strptime(end_date, "%Y-%m-%d")
-
-    portfolio = Portfolio(starting_capital, monthly_investment, rules, end_date, start_date)
-    portfolio.backtest()
-    
-    # Get all stats including SPY comparison
-    stats = portfolio.get_total_stats()
-    
+class ResponseGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves the server-sent event streams alone: it buffers a streamed
+    body in zlib until enough has been written, so progress events would not arrive until
+    the job was done.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/events"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Daily series compress well, so gzip responses for clients that accept it
+app.add_middleware(ResponseGZipMiddleware, minimum_size=1000)
+
+# Backtests run on a bounded process pool; see jobs.JobManager
+job_manager = JobManager(
+    workers=int(os.getenv('BACKTEST_WORKERS', '2')),
+    max_active=int(os.getenv('BACKTEST_MAX_ACTIVE', '16')),
+    db_connections=int(os.getenv('BACKTEST_DB_CONNECTIONS', '2')),
+    cache=ResultCache(max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024),
+)
+
+# a /backtest/batch request may compare at most this many strategies
+BATCH_MAX_STRATEGIES = int(os.getenv('BATCH_MAX_STRATEGIES', '20'))
+
+def check_backtest_options(payload):
+    """Raise ValueError, KeyError or TypeError unless the dates, money and schedules of a backtest payload are valid"""
+    datetime.strptime(payload["start_date"], "%Y-%m-%d")
+    datetime.strptime(payload["end_date"], "%Y-%m-%d")
+    float(payload["starting_capital"])
+    float(payload["monthly_investment"])
+    if payload.get("layout", "records") not in RESPONSE_LAYOUTS:
+        raise ValueError(f"layout must be one of {RESPONSE_LAYOUTS}")
+    check_schedule(payload.get("rebalance", "monthly"))
+    check_schedule(payload.get("contribution_schedule", "monthly"))
+    execution_options(payload.get("execution"))
+
+@app.post("/backtest", status_code=202)
+async def backtest(payload: dict):
+    """
+    Queue a backtest and return its job id. Poll GET /backtest/{job_id} or stream /backtest/{job_id}/events.
+    An optional "layout" of "columnar" returns the daily series as a dates array plus value arrays.
+    "rebalance" and "contribution_schedule" default to "monthly"; see Portfolio.
+    An optional "execution" object sets the fill price and trading costs; see execution.execution_options.
+    """
+    try:
+        check_backtest_options(payload)
+        payload["rules"]
+    except (KeyError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid backtest request: {e}")
+
     try:
-        # Clean and convert the data for JSON serialization
-        clean_results = clean_data_for_json(stats['daily_values'])
-        
-        # Convert SPY values to a proper DataFrame with date index
-        spy_df = pd.DataFrame(
-            stats['spy_stats']['spy_values'],
-            index=stats['daily_values'].index
-        )
-        clean_spy_values = clean_data_for_json(spy_df)
-        
-        response_data = {
-            "daily_values": clean_results,
-            "spy_values": clean_spy_values,
-            "stats": {}
-        }
-
-        # Carefully clean and add each stat
-        for key, value in stats["portfolio_stats"].items():
-            if isinstance(value, (np.floating, float)):
-                if math.isnan(value) or math.isinf(value):
-                    response_data["stats"][key] = None
-                else:
-                    response_data["stats"][key] = float(value)
-            elif isinstance(value, np.integer):
-                response_data["stats"][key] = int(value)
+        # submit reads the price data version from the database, so keep it off the event loop
+        job = await run_in_threadpool(job_manager.submit, payload)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except WorkerPoolError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return job.to_dict()
+
+def load_strategy_rules(strategy_ids):
+    """{id: (name, rules tree)} for the saved strategies among strategy_ids"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, name, rules
+                FROM strategies
+                WHERE id = ANY(%s)
+            """, (list(strategy_ids),))
+            rows = cur.fetchall()
+    strategies = {}
+    for strategy_id, name, rules in rows:
+        rules = json.loads(rules) if isinstance(rules, str) else rules
+        # saved strategies wrap the tree as {"rules": tree}
+        strategies[strategy_id] = (name, rules.get('rules', rules))
+    return strategies
+
+@app.post("/backtest/batch", status_code=202)
+async def backtest_batch(payload: dict):
+    """
+    Queue a backtest of several strategies over the same dates and money and return its job
+    id, polled like /backtest. "strategies" is a list of {"name", "rules"} documents or
+    {"strategy_id"} of saved strategies. The result has each strategy's daily values and
+    stats under "strategies", and the SPY benchmark once.
+    """
+    try:
+        check_backtest_options(payload)
+        strategies = payload["strategies"]
+        if not isinstance(strategies, list) or not strategies:
+            raise ValueError("strategies must be a non-empty list")
+        if len(strategies) > BATCH_MAX_STRATEGIES:
+            raise ValueError(f"at most {BATCH_MAX_STRATEGIES} strategies can be compared at once")
+        for strategy in strategies:
+            if "strategy_id" in strategy:
+                int(strategy["strategy_id"])
             else:
-                response_data["stats"][key] = str(value)
-
-        # Test JSON serialization before sending
-        test_json = json.dumps(response_data, cls=CustomJSONEncoder)
-        # print(test_json)
-        with open('response.json', 'w') as f:
-            json.dump(response_data, f, cls=CustomJSONEncoder)
-        
-        return fastapi.Response(
-            content=test_json,
-            media_type="application/json"
-        )
-        
-    except Exception as e:
-        print(f"Error preparing response: {str(e)}")
-        # Return a simplified error response
-        return fastapi.Response(
-            content=json.dumps({
-                "error": "Error preparing response data",
-                "details": str(e)
-            }),
-            media_type="application/json",
-            status_code=500
-        )
+                strategy["rules"]
+    except (KeyError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch backtest request: {e}")
+
+    strategy_ids = [int(strategy["strategy_id"]) for strategy in strategies if "strategy_id" in strategy]
+    saved = await run_in_threadpool(load_strategy_rules, strategy_ids) if strategy_ids else {}
+    missing = sorted(set(strategy_ids) - set(saved))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Strategies not found: {missing}")
+
+    resolved = []
+    for i, strategy in enumerate(strategies):
+        if "strategy_id" in strategy:
+            name, rules = saved[int(strategy["strategy_id"])]
+            resolved.append({"name": name, "rules": rules, "strategy_id": int(strategy["strategy_id"])})
+        else:
+            resolved.append({"name": strategy.get("name") or f"Strategy {i + 1}", "rules": strategy["rules"]})
+
+    try:
+        job = await run_in_threadpool(job_manager.submit, {**payload, "strategies": resolved}, run=run_batch_job)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except WorkerPoolError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return job.to_dict()
+
+@app.get("/backtest/{job_id}")
+async def get_backtest(job_id: str):
+    """Return a job's status, with the backtest response under 'result' once it is done"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    return fastapi.Response(content=job.response_json(), media_type="application/json")
+
+@app.get("/backtest/{job_id}/events")
+async def backtest_events(job_id: str):
+    """Stream a job's status and progress as server-sent events until it finishes"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+
+    async def events():
+        last_update = None
+        while True:
+            if job.updated_at != last_update:
+                last_update = job.updated_at
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.status in ('done', 'failed'):
+                break
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/stats")
+async def stats():
+    """Job counts, and the size and hit/miss counts of the result and indicator caches"""
+    return job_manager.stats()
 
 @app.post("/save_strategy")
 async def save_strategy(strategy: dict):
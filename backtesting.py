@@ -1,6 +1,13 @@
 from datetime import datetime
-from trading_system import load_rules, run_trading_system
-from data_fetcher import load_historical_data, get_trading_days, load_daily_values
+from trading_system import load_rules, run_trading_system, compile_rules
+from data_fetcher import get_trading_calendar, load_daily_values
+from trading_calendar import check_schedule
+from indicator_engine import IndicatorEngine
+from signals import build_signal_matrix
+from ledger import Ledger
+from benchmark import dca_values
+from execution import FillPrices, EXECUTION_PRICES
+from prefetch import prefetch
 import termcolor
 from dateutil.relativedelta import relativedelta
 import pandas as pd
@@ -9,93 +16,125 @@ import time
 import matplotlib.pyplot as plt
 from dataclasses import dataclass
 import decimal
+import argparse
+import sys
 
 @dataclass
 class Share:
-    shares: decimal.Decimal
-    price: decimal.Decimal
+    shares: float # np.float64, or decimal.Decimal when precision='decimal'
+    price: float
+
+# number type used for cash, prices and share counts in each precision mode
+precision_types = {
+    'float64': np.float64,
+    'decimal': decimal.Decimal,
+}
 
 class Portfolio:
-    def __init__(self, starting_capital, monthly_investment, rules, end_date, start_date):
+    def __init__(self, starting_capital, monthly_investment, rules, end_date, start_date, vectorized=False, precision='float64',
+                 rebalance='monthly', contribution_schedule='monthly', execution='close', slippage=None, commission=None):
+        """
+        precision='float64' runs the accounting in NumPy float64. precision='decimal' keeps
+        the slower decimal.Decimal accounting of cash and trades as an audit mode. The daily
+        values are still computed from the float64 Ledger in either mode.
+
+        rebalance and contribution_schedule are 'daily', 'weekly', 'monthly', 'quarterly' or a
+        list of dates; see TradingCalendar.schedule_sessions. monthly_investment is added on
+        every contribution date.
+
+        execution is when orders fill, one of execution.EXECUTION_PRICES. slippage and
+        commission are optional execution.Slippage and execution.Commission models; fees
+        are paid out of cash, so a buy spends its share of cash on shares and fees together.
+        Positions are recorded on the rebalance date whichever price they fill at.
+        """
+        if precision not in precision_types:
+            raise ValueError(f"Unknown precision: {precision}")
+        if execution not in EXECUTION_PRICES:
+            raise ValueError(f"Unknown execution price {execution}, expected one of {EXECUTION_PRICES}")
+        check_schedule(rebalance)
+        check_schedule(contribution_schedule)
+        self.rebalance_schedule = rebalance
+        self.contribution_schedule = contribution_schedule
+        self.precision = precision
+        self.number = precision_types[precision]
+
         self.starting_capital = starting_capital
-        self.monthly_investment = monthly_investment
-        self.cash = starting_capital
+        self.monthly_investment = self.number(monthly_investment)
+        self.cash = self.number(starting_capital)
         self.shares = {} # symbol: Share
         self.rules = rules
+        self.strategy = compile_rules(rules)
         self.end_date = end_date
         self.start_date = start_date
         self.min_cash = 5
+        self.execution = execution
+        self.slippage = slippage
+        self.commission = commission
+        # execution prices of every rebalance, created in backtest() once the dates are known
+        self.fills = None
         self.inital_start_date = start_date
         self.inital_end_date = end_date
         self.portfolio_value_history = {}
-        self.portfolio_shares_history = {}
-        self.portfolio_cash_history = {}
+        # daily positions and cash, created in backtest() once the sessions are known
+        self.ledger = None
 
+        # the SPY dollar-cost averaging benchmark, see benchmark.dca_values
         self.spy_value_history = {}
-        self.spy_shares_history = {}
-        self.spy_shares = 0
-        self.spy_cash = starting_capital
-        self.spy_cash_history = {}
-
-        # Add new instance variable
-        self.monthly_trading_days = self._precompute_monthly_trading_days(get_trading_days())
-
-    def _precompute_monthly_trading_days(self, trading_days):
-        """Precompute first and last trading days for each month"""
-        monthly_days = {}
-        for day in trading_days:
-            key = (day.year, day.month)
-            if key not in monthly_days:
-                monthly_days[key] = {'first': day, 'last': day}
-            else:
-                monthly_days[key]['last'] = day
-        return monthly_days
 
-    def buy(self, symbol, price, quantity, date, previous_shares):
+        # indicator series are computed once for the whole backtest and looked up per date
+        self.indicator_engine = IndicatorEngine()
+        # when vectorized, the strategy is evaluated for every rebalance date before the loop
+        self.vectorized = vectorized
+        self.signals = None
+
+        # sessions and their month boundaries, shared by every backtest
+        self.calendar = get_trading_calendar()
+
+    def buy(self, symbol, price, quantity, fee=0):
         cost = price * quantity
-        self.cash -= cost
+        self.cash -= cost + fee
         if symbol not in self.shares:
             self.shares[symbol] = Share(quantity, price)
         else:
-            self.shares[symbol].shares += quantity
-            self.shares[symbol].price = (self.shares[symbol].price * self.shares[symbol].shares + price * quantity) / (self.shares[symbol].shares + quantity)
-
-
-        # update portfolio shares history using previous shares
-        existing_shares = previous_shares.get(symbol, 0)
-        if date.date() not in self.portfolio_shares_history:
-            self.portfolio_shares_history[date.date()] = previous_shares
-        self.portfolio_shares_history[date.date()][symbol] = existing_shares + quantity
-        # print(self.portfolio_shares_history)
-        # print("-----")
+            share = self.shares[symbol]
+            total = share.shares + quantity
+            # average cost; a zero-share top-up (cash at min_cash) leaves it alone
+            if total:
+                share.price = (share.price * share.shares + price * quantity) / total
+            share.shares = total
 
         print(f"{termcolor.colored('Bought', 'green')} {termcolor.colored(symbol, 'magenta')} {quantity:.2f} shares @ ${price:.2f}")
 
-    def sell(self, symbol, price, quantity, date, previous_shares):
-        self.cash += price * quantity
+    def sell(self, symbol, price, quantity, fee=0):
+        self.cash += price * quantity - fee
         if self.shares[symbol].shares == quantity:
             del self.shares[symbol]
         else:
             self.shares[symbol].shares -= quantity
-            
-        existing_shares = previous_shares.get(symbol, 0)
-        if date.date() not in self.portfolio_shares_history:
-            self.portfolio_shares_history[date.date()] = previous_shares
-        self.portfolio_shares_history[date.date()][symbol] = existing_shares - quantity
 
         print(f"{termcolor.colored('Sold', 'red')} {termcolor.colored(symbol, 'magenta')} {quantity:.2f} shares @ ${price:.2f}")
 
 
-    def is_last_trading_day_of_month(self, date, trading_days, first_of_month=True):
-        """
-        Check if the date is the first or last trading day of that month
-        """
-        if date.date() in trading_days:
-            key = (date.year, date.month)
-            if key in self.monthly_trading_days:
-                target_day = self.monthly_trading_days[key]['first' if first_of_month else 'last']
-                return date.date() == target_day
-        return False
+    def _backtest_dates(self, days):
+        """days within start_date..end_date as datetimes, up to the last one a month before today"""
+        dates = [datetime.combine(day, self.start_date.time()) for day in days]
+        dates = [date for date in dates if self.start_date <= date <= self.end_date]
+        # stop if the next month is in the future. this might not be correct
+        while dates and dates[-1] + relativedelta(months=1) > datetime.now():
+            dates.pop()
+        return dates
+
+    def session_dates(self):
+        """The trading days the backtest covers, in order"""
+        return self._backtest_dates(self.calendar.sessions_between(self.start_date, self.end_date))
+
+    def rebalance_dates(self):
+        """The dates backtest() runs the strategy on, in order"""
+        return self._backtest_dates(self.calendar.schedule_sessions(self.rebalance_schedule))
+
+    def contribution_dates(self):
+        """The dates backtest() adds monthly_investment on, in order"""
+        return self._backtest_dates(self.calendar.schedule_sessions(self.contribution_schedule))
 
     def current_holdings(self):
         df = pd.DataFrame([(symbol, share.shares) for symbol, share in self.shares.items()], columns=['Symbol', 'Shares'])
@@ -145,6 +184,31 @@ class Portfolio:
         """Calculate various SPY performance metrics"""
         return self.stats(self.spy_value_history)
 
+    def get_total_stats(self, benchmark=True):
+        """
+        Daily values, stats and the SPY comparison in the shape api.py serializes. Without
+        benchmark the SPY comparison is left out, for callers that compute it once for
+        several portfolios
+        """
+        dates = pd.to_datetime(list(self.portfolio_value_history.keys()))
+        daily_values = pd.DataFrame({
+            'portfolio_value': np.array(list(self.portfolio_value_history.values()), dtype=float),
+        }, index=dates)
+        daily_values['daily_return'] = daily_values['portfolio_value'].pct_change()
+
+        portfolio_stats = self.stats().iloc[0].to_dict()
+        # the frontend reads CAGR as 'Annualized Return'
+        portfolio_stats['Annualized Return'] = portfolio_stats['CAGR']
+
+        stats = {
+            'daily_values': daily_values,
+            'portfolio_stats': portfolio_stats,
+        }
+        if benchmark:
+            stats['spy_stats'] = self.spy_stats().iloc[0].to_dict()
+            stats['spy_stats']['spy_values'] = {'SPY': np.array(list(self.spy_value_history.values()), dtype=float)}
+        return stats
+
     def calculate_beta(self, df, spy_df):
         return df['Portfolio Value'].pct_change().corr(spy_df['SPY Value'].pct_change())
 
@@ -182,113 +246,100 @@ class Portfolio:
     def calculate_total_return(self, df):
         return df['Portfolio Value'].iloc[-1] / df['Portfolio Value'].iloc[0] - 1
 
-    def backtest(self):
-        current_date = self.start_date
-        # get valid trading days
-        trading_days = get_trading_days()
-
-        while current_date <= self.end_date:
-            if current_date + relativedelta(months=1) > datetime.now(): # stop if the next month is in the future. this might not be correct
-                break
-            
-            if current_date.date() in trading_days:
-                if self.is_last_trading_day_of_month(current_date, trading_days):
-                    self.spy_buy_and_hold(current_date)
-                    self.next_month(current_date)
-                else:
-                    if len(self.spy_shares_history) > 0:
-                        previous_day = sorted(self.spy_shares_history.keys())[-1]
-                        self.spy_shares_history[current_date.date()] = self.spy_shares_history[previous_day]
-                        self.portfolio_shares_history[current_date.date()] = self.portfolio_shares_history.get(previous_day, {})
-                        self.spy_cash_history[current_date.date()] = self.spy_cash_history[previous_day]
-                        self.portfolio_cash_history[current_date.date()] = self.portfolio_cash_history[previous_day]
-                    else:
-                        self.spy_shares_history[current_date.date()] = 0
-                        self.portfolio_shares_history[current_date.date()] = {}
-                        self.spy_cash_history[current_date.date()] = self.spy_cash
-                        self.portfolio_cash_history[current_date.date()] = self.cash
-                        
-            current_date += relativedelta(days=1)
-        
+    def backtest(self, progress=None):
+        """Run the backtest. progress, if given, is called as progress(completed, total) after each rebalance or contribution"""
+        # compute every indicator the strategy needs up front
+        for request in self.strategy.requests:
+            self.indicator_engine.series(request.func, request.symbol, request.params)
+
+        rebalance_dates = self.rebalance_dates()
+        self.fills = FillPrices(self.strategy.symbols, rebalance_dates, self.execution)
+        # a next_open rebalance on the last bar has nothing to fill at until the next one arrives
+        rebalance_dates = [date for date in rebalance_dates if self.fills.fillable(date)]
+        if self.vectorized:
+            self.signals = build_signal_matrix(self.strategy, rebalance_dates, self.indicator_engine)
+
+        sessions = [date.date() for date in self.session_dates()]
+        self.ledger = Ledger(sessions, self.cash)
+
+        # only rebalance and contribution sessions do any work; the ledgers carry positions forward on the rest
+        rebalances = set(rebalance_dates)
+        contributions = set(self.contribution_dates())
+        event_dates = sorted(rebalances | contributions)
+        for completed, date in enumerate(event_dates, 1):
+            if date in contributions:
+                self.contribute(date)
+            if date in rebalances:
+                self.rebalance(date)
+            else:
+                self.ledger.record(date, {symbol: share.shares for symbol, share in self.shares.items()}, self.cash)
+            if progress is not None:
+                progress(completed, len(event_dates))
+
         self.get_daily_values()
 
 
-    def spy_buy_and_hold(self, date):
-        self.spy_cash += self.monthly_investment
-        # buy spy
-        df = load_historical_data('SPY', date)
-        closest_date = df.index.get_indexer([date], method='nearest')[0]
-        price = df['adj_close'].iloc[closest_date]
-        shares = (self.spy_cash - self.min_cash) / price
-        self.spy_shares += shares
-        
-        # Carry forward previous shares and add new shares
-        previous_shares = 0
-        if len(self.spy_shares_history) > 0:
-            previous_date = sorted(self.spy_shares_history.keys())[-1]
-            previous_shares = self.spy_shares_history[previous_date]
-        self.spy_shares_history[date.date()] = previous_shares + shares
-
-        # subtract cash from spy
-        self.spy_cash -= price * shares
-        self.spy_cash_history[date.date()] = self.spy_cash
-
-    def next_month(self, date):
-        print(f"Running for {date}")
+    def fill_prices(self, date, sells, buys):
+        """The execution prices, after slippage, of the symbols a rebalance sells and buys, looked up together"""
+        prices = self.fills.prices(date, sells + buys)
+        missing = [symbol for symbol, price in zip(sells + buys, prices) if np.isnan(price)]
+        if missing:
+            raise ValueError(f"No {self.execution} price for {missing} on {date}")
+        sell_prices, buy_prices = prices[:len(sells)], prices[len(sells):]
+        if self.slippage is not None:
+            sell_prices = self.slippage.adjust(sell_prices, 'sell')
+            buy_prices = self.slippage.adjust(buy_prices, 'buy')
+        return (
+            {symbol: self.number(price) for symbol, price in zip(sells, sell_prices)},
+            {symbol: self.number(price) for symbol, price in zip(buys, buy_prices)},
+        )
+
+    def fee(self, price, quantity):
+        if self.commission is None or not quantity:
+            return 0
+        return self.commission.fee(price * quantity)
+
+    def contribute(self, date):
+        """Add monthly_investment to the portfolio's cash. The SPY benchmark gets the same in get_daily_values"""
         self.cash += self.monthly_investment
-        transactions = run_trading_system(self.rules, date)
-
 
-        if len(self.portfolio_shares_history) > 0:
-            previous_date = sorted(self.portfolio_shares_history.keys())[-1]
-            previous_shares = self.portfolio_shares_history[previous_date].copy()
+    def rebalance(self, date):
+        print(f"Running for {date}")
+        if self.signals is not None:
+            transactions = self.signals.transactions(date)
         else:
-            previous_shares = {}
-
-        for symbol, percentage in transactions['sell'].items():
-            if symbol in self.shares:
-                df = load_historical_data(symbol, date)
-                closest_date = df.index.get_indexer([date], method='nearest')[0]
-                price = df['adj_close'].iloc[closest_date]
-                # convert percentage to decimal.Decimal
-                percentage = decimal.Decimal(percentage)
-                shares = self.shares[symbol].shares * percentage
-                self.sell(symbol, price, shares, date, previous_shares)
+            transactions = run_trading_system(self.strategy, date, self.indicator_engine)
+
+        sells = [symbol for symbol in transactions['sell'] if symbol in self.shares]
+        sell_prices, buy_prices = self.fill_prices(date, sells, list(transactions['buy']))
+
+        for symbol in sells:
+            price = sell_prices[symbol]
+            percentage = self.number(transactions['sell'][symbol])
+            shares = self.shares[symbol].shares * percentage
+            self.sell(symbol, price, shares, self.fee(price, shares))
 
         for symbol, percentage in transactions['buy'].items():
-            df = load_historical_data(symbol, date)
-            closest_date = df.index.get_indexer([date], method='nearest')[0]
-            price = df['adj_close'].iloc[closest_date]
-            # convert percentage to decimal.Decimal
-            percentage = decimal.Decimal(percentage)
-            shares = (self.cash - self.min_cash) * percentage / price
-            self.buy(symbol, price, shares, date, previous_shares)
+            price = buy_prices[symbol]
+            percentage = self.number(percentage)
+            budget = (self.cash - self.min_cash) * percentage
+            shares = budget / price if self.commission is None else self.commission.quantity(budget, price)
+            self.buy(symbol, price, shares, self.fee(price, shares))
 
-        
-        self.portfolio_cash_history[date.date()] = self.cash
+        self.ledger.record(date, {symbol: share.shares for symbol, share in self.shares.items()}, self.cash)
         print(f"Cash Remaining: ${self.cash:.2f}")
         print(f"--------------\n")
 
-    def get_daily_values(self): # TODO: fix this. the shares are only being account for at the end of the backtest.
-        # need to get all symbols in portfolio_shares_history
-        symbols = set([symbol for date in self.portfolio_shares_history for symbol in self.portfolio_shares_history[date]])
-        symbols.add('SPY')
-        if len(symbols) == 0:
-            return
-        daily_values = load_daily_values(tuple(sorted(symbols)), self.inital_start_date, self.inital_end_date)
+    def get_daily_values(self):
+        """Value the recorded positions on every session with one vectorized pass over the price matrix"""
+        daily_values = load_daily_values(tuple(sorted(self.ledger.symbols)), self.inital_start_date, self.inital_end_date)
 
-        for date in self.portfolio_shares_history:
-            total_value = 0
-            # print(f"[{date}] PORTFOLIO SHARES: {self.portfolio_shares_history[date]}")
-            for symbol in self.portfolio_shares_history[date]:
-                total_value += decimal.Decimal(self.portfolio_shares_history[date][symbol]) * decimal.Decimal(daily_values.loc[date][symbol])
-            self.portfolio_value_history[date] = total_value + decimal.Decimal(self.portfolio_cash_history[date])
+        dates = self.ledger.dates.date
+        self.portfolio_value_history = dict(zip(dates, self.ledger.values(daily_values)))
 
-        spy_daily_values = daily_values.loc[:, 'SPY']
-        for date in self.spy_shares_history:
-            price = spy_daily_values.loc[date]
-            shares = self.spy_shares_history[date]
-            self.spy_value_history[date] = shares * decimal.Decimal(price) + decimal.Decimal(self.spy_cash_history[date])
+        contribution_dates = tuple(date.date() for date in self.contribution_dates())
+        spy_values = dca_values('SPY', tuple(dates), contribution_dates, self.starting_capital, self.monthly_investment, self.min_cash, self.number)
+        self.spy_value_history = dict(zip(dates, spy_values))
 
 
     def plot(self):
@@ -323,7 +374,37 @@ class Portfolio:
         plt.grid(True)
         plt.show()
 
+def check_precision(starting_capital, monthly_investment, rules, end_date, start_date, tolerance=1e-9):
+    """
+    Run the same backtest in float64 and decimal precision and check that the final
+    portfolio and SPY values agree within a relative tolerance. Only the trade accounting
+    differs between the two; see Portfolio. Run it with backtesting.py --check-precision
+    """
+    results = {}
+    for precision in precision_types:
+        portfolio = Portfolio(starting_capital, monthly_investment, rules, end_date, start_date, precision=precision)
+        portfolio.backtest()
+        results[precision] = (
+            float(list(portfolio.portfolio_value_history.values())[-1]),
+            float(list(portfolio.spy_value_history.values())[-1]),
+        )
+
+    passed = True
+    for i, name in enumerate(['Portfolio', 'SPY']):
+        float_value, decimal_value = results['float64'][i], results['decimal'][i]
+        difference = abs(float_value - decimal_value) / abs(decimal_value)
+        ok = difference <= tolerance
+        passed = passed and ok
+        print(f"{name}: float64 ${float_value:,.6f} decimal ${decimal_value:,.6f} relative difference {difference:.2e} {termcolor.colored('OK' if ok else 'FAILED', 'green' if ok else 'red')}")
+    return passed
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest rules.json since 2012 and plot it against SPY")
+    parser.add_argument('--check-precision', action='store_true',
+                        help="instead run it in float64 and decimal precision and exit non-zero if they disagree")
+    parser.add_argument('--tolerance', type=float, default=1e-9, help="relative tolerance for --check-precision")
+    args = parser.parse_args()
+
     start = time.time()
     start_date = datetime(2012, 1, 1)
     end_date = datetime.now()
@@ -332,6 +413,10 @@ if __name__ == "__main__":
     monthly_investment = 100
 
     rules = load_rules('rules.json')
+    prefetch(rules)
+
+    if args.check_precision:
+        sys.exit(0 if check_precision(starting_capital, monthly_investment, rules, end_date, start_date, args.tolerance) else 1)
 
     portfolio = Portfolio(starting_capital, monthly_investment, rules, end_date, start_date)
     portfolio.backtest()
@@ -345,7 +430,3 @@ if __name__ == "__main__":
     print("Current Holdings:")
     print(portfolio.current_holdings())
     portfolio.plot()
-    # for date in portfolio.portfolio_shares_history:
-    #     print(f"[{date}] {portfolio.portfolio_shares_history[date]}")
-
-
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import time
+from termcolor import colored
+from backtesting import Portfolio
+from execution import execution_options
+from indicator_engine import IndicatorEngine
+from prefetch import prefetch_symbols, rules_symbols
+from serialization import batch_response
+from trading_system import compile_rules
+
+def run_strategy(rules, start_date, end_date, starting_capital, monthly_investment, rebalance, contribution_schedule, execution, benchmark):
+    """Backtest one strategy of a batch and return its get_total_stats, with the SPY comparison only if benchmark"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        portfolio = Portfolio(
+            starting_capital, monthly_investment, rules, end_date, start_date, vectorized=True,
+            rebalance=rebalance, contribution_schedule=contribution_schedule, **execution_options(execution),
+        )
+        portfolio.backtest()
+        return portfolio.get_total_stats(benchmark=benchmark)
+
+def run_batch(strategies, start_date, end_date, starting_capital, monthly_investment,
+              rebalance='monthly', contribution_schedule='monthly', execution=None, layout='records', progress=None):
+    """
+    Backtest several strategies over the same dates and return one batch_response.
+
+    Prices for the union of their symbols are loaded once and every distinct indicator
+    series is computed once into the process's indicator cache. The strategies then run
+    one after another in this process, so a batch job takes one JobManager worker like
+    any other job. The SPY benchmark is the same for every strategy, so its history and
+    stats are only computed and serialized for the first.
+    execution is the payload's "execution" object, see execution.execution_options.
+    progress(completed, total) is called as strategies finish.
+    """
+    start = time.time()
+    prefetch_symbols(sorted(set().union(*(rules_symbols(rules) for rules in strategies))))
+
+    engine = IndicatorEngine()
+    requests = {request for rules in strategies for request in compile_rules(rules).requests}
+    for request in requests:
+        engine.series(request.func, request.symbol, request.params)
+    print(f"Prepared {len(strategies)} strategies: {len(requests)} indicator series in {time.time() - start:.2f}s")
+
+    start = time.time()
+    totals = []
+    for i, rules in enumerate(strategies):
+        totals.append(run_strategy(
+            rules, start_date, end_date, starting_capital, monthly_investment,
+            rebalance, contribution_schedule, execution, i == 0,
+        ))
+        if progress is not None:
+            progress(i + 1, len(strategies))
+
+    print(colored(f"Backtested {len(strategies)} strategies in {time.time() - start:.2f}s", 'green'))
+    return batch_response(strategies, totals, totals[0], layout)
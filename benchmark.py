@@ -0,0 +1,52 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from data_fetcher import price_store, load_daily_values
+from price_store import PRICE_COLUMNS
+
+@lru_cache(maxsize=64)
+def dca_values(symbol, sessions, contribution_dates, starting_capital, contribution, min_cash=5, number=np.float64):
+    """
+    Daily value of buying and holding symbol with dollar-cost averaging: starting_capital
+    plus contribution on every contribution date, each time investing all but min_cash at
+    the last adjusted close. sessions and contribution_dates are tuples of datetime.date,
+    number the type the cash and share arithmetic runs in (see backtesting.precision_types).
+
+    Every strategy with the same dates and contributions has the same benchmark, so the
+    result is memoized; it is a read-only float64 array aligned to sessions.
+    """
+    if not sessions:
+        return np.empty(0)
+    dates, values = price_store.arrays(symbol)
+    adj_close = values[:, PRICE_COLUMNS.index('adj_close')]
+
+    # the last adjusted close on or before each contribution, in one lookup
+    positions = dates.searchsorted(np.array(contribution_dates, dtype='datetime64[ns]'), side='right') - 1
+    if len(positions) and positions[0] < 0:
+        raise ValueError(f"No price data for {symbol} on or before {contribution_dates[0]}")
+
+    # each contribution buys with everything above min_cash, and the cash left is only the
+    # rounding, but it is carried along so the curve matches a simulation to the last bit
+    cash = number(starting_capital)
+    held = number(0)
+    shares = np.empty(len(positions))
+    balances = np.empty(len(positions))
+    for i, price in enumerate(adj_close[positions]):
+        price = number(price)
+        cash += contribution
+        bought = (cash - min_cash) / price
+        held += bought
+        cash -= price * bought
+        shares[i] = held
+        balances[i] = cash
+
+    # value every session with the position after the last contribution on or before it
+    rows = np.searchsorted(np.array(contribution_dates, dtype='datetime64[D]'), np.array(sessions, dtype='datetime64[D]'), side='right') - 1
+    held = np.where(rows >= 0, shares[np.maximum(rows, 0)], 0.0)
+    cash = np.where(rows >= 0, balances[np.maximum(rows, 0)], float(number(starting_capital)))
+    prices = load_daily_values((symbol,), sessions[0], sessions[-1])[symbol]
+    prices = prices.reindex(pd.DatetimeIndex(sessions)).to_numpy(dtype=np.float64)
+
+    result = np.where(held != 0, held * prices, 0.0) + cash
+    result.flags.writeable = False
+    return result
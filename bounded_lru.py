@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+
+class BoundedLRU:
+    """
+    A thread-safe mapping that evicts least recently used entries once the sizes of the
+    values held, as sizeof(value) counts them, exceed max_bytes.
+
+    With keep_last the most recent entry stays even if it alone exceeds the budget, for
+    caches whose callers need the value they just stored. on_evict(key, value) is called
+    for every entry evicted to make room.
+    """
+
+    def __init__(self, max_bytes, sizeof, keep_last=False, on_evict=None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.keep_last = keep_last
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """The value for key, marked as most recently used, or default"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+            return default
+
+    def put(self, key, value, replace=True):
+        """
+        Store value under key and return what is stored. Without replace an existing entry
+        is kept, e.g. when another thread loaded the same key first, and returned instead.
+        """
+        with self._lock:
+            if key in self._entries and not replace:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            if key in self._entries:
+                self._bytes -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += self.sizeof(value)
+            evicted = self._evict()
+        for evicted_key, evicted_value in evicted:
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted_value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries.pop(key)
+            self._bytes -= self.sizeof(value)
+            return value
+
+    def pop_where(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._bytes -= self.sizeof(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+    def _evict(self):
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._entries) > (1 if self.keep_last else 0):
+            key, value = self._entries.popitem(last=False)
+            self._bytes -= self.sizeof(value)
+            self._evictions += 1
+            evicted.append((key, value))
+        return evicted
@@ -1,7 +1,13 @@
+import os
 from functools import lru_cache
 import yfinance as yf
+import numpy as np
 import pandas as pd
-from database import get_db_connection, save_price_data
+import database
+from database import get_db_connection, fetch_price_arrays, save_price_data
+from price_files import has_price_file, read_price_file, read_version, write_price_file
+from price_store import PRICE_COLUMNS, PriceStore
+from trading_calendar import TradingCalendar
 
 
 def check_symbol_exists(symbol):
@@ -11,41 +17,20 @@ def check_symbol_exists(symbol):
     except Exception as e:
         return False
 
-def get_trading_days():
-    # loads SPY and returns trading days
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT date FROM prices WHERE symbol = 'SPY'
-            """)
-            trading_days = cur.fetchall()
+@lru_cache(maxsize=1)
+def get_trading_calendar():
+    # SPY's history defines the trading days
+    dates, _ = price_store.arrays('SPY')
+    return TradingCalendar(dates)
 
-    # put in list format
-    trading_days = [day[0] for day in trading_days]
-    return trading_days
+def get_trading_days():
+    return list(get_trading_calendar().days)
 
 
 @lru_cache(maxsize=128)
 def get_earliest_date(symbol):
-    with get_db_connection() as conn:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT MIN(date) FROM prices WHERE symbol = %s
-                """, (symbol,))
-                earliest_date = cur.fetchone()[0]
-                if earliest_date is None:
-                    raise ValueError(f"No data found for symbol: {symbol}")
-        except Exception as e:
-            # check if symbol exists
-            if not check_symbol_exists(symbol):
-                raise ValueError(f"Symbol {symbol} does not exist")
-            else:
-                # fetch data from yahoo finance
-                get_price_data_as_dataframe(symbol)
-                earliest_date = get_earliest_date(symbol)
-
-    return earliest_date
+    dates, _ = price_store.arrays(symbol)
+    return pd.Timestamp(dates[0]).date()
 
 def get_price_data_as_dataframe(symbol):
     print(f"Fetching data for symbol: {symbol}...")
@@ -57,63 +42,78 @@ def get_price_data_as_dataframe(symbol):
 
     save_price_data(symbol, df)
 
-@lru_cache(maxsize=128)
-def load_historical_data(symbol, end_date=None):
-    # Convert end_date to string if it exists, since datetime objects aren't hashable
-    cache_key_date = end_date.isoformat() if end_date else None
-    return _load_historical_data(symbol, cache_key_date)
-
-def _load_historical_data(symbol, end_date=None):
+def _fetch_price_arrays(symbol):
+    """Load a symbol's full history from the database as (dates, values) arrays for the price store"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            if end_date:
-                cur.execute("""
-                    SELECT date, open, high, low, close, adj_close, volume
-                    FROM prices
-                    WHERE symbol = %s AND date <= %s
-                    ORDER BY date
-                """, (symbol, end_date))
-            else:
-                cur.execute("""
-                    SELECT date, open, high, low, close, adj_close, volume
-                    FROM prices
-                    WHERE symbol = %s
-                    ORDER BY date
-                """, (symbol,))
-            data = cur.fetchall()
-
-    if not data:
+            arrays = fetch_price_arrays(cur, [symbol])
+        conn.rollback() # don't leave the pooled connection idle in a transaction
+
+    if symbol not in arrays:
+        # check if symbol exists
+        if not check_symbol_exists(symbol):
+            raise ValueError(f"Symbol {symbol} does not exist")
+        # fetch data from yahoo finance
         get_price_data_as_dataframe(symbol)
-        df = load_historical_data(symbol, end_date)
-        if end_date:
-            df = df[(df.index.date <= end_date.date())]
-    else:
-        df = pd.DataFrame(data, columns=['date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
-        df.set_index('date', inplace=True)
-        df.index = pd.to_datetime(df.index)
-    
-    return df
+        return _fetch_price_arrays(symbol)
+
+    return arrays[symbol]
+
+# 'postgres' reads prices from the database. 'files' memory-maps the local price files the
+# DPU keeps in PRICE_FILES_DIR, and only goes to the database for a symbol without one
+PRICE_BACKEND = os.getenv('PRICE_BACKEND', 'postgres')
+PRICE_FILES_DIR = os.getenv('PRICE_FILES_DIR', 'price_cache')
+
+def _load_price_file(symbol):
+    """Memory-map a symbol's price file, creating it from the database the first time"""
+    if not has_price_file(PRICE_FILES_DIR, symbol):
+        dates, values = _fetch_price_arrays(symbol)
+        write_price_file(PRICE_FILES_DIR, symbol, dates, values)
+    return read_price_file(PRICE_FILES_DIR, symbol)
+
+price_loaders = {
+    'postgres': _fetch_price_arrays,
+    'files': _load_price_file,
+}
+if PRICE_BACKEND not in price_loaders:
+    raise ValueError(f"Unknown PRICE_BACKEND {PRICE_BACKEND}, expected one of {list(price_loaders)}")
+
+# Full histories are loaded once per symbol and shared by every backtest in the process
+price_store = PriceStore(price_loaders[PRICE_BACKEND], max_bytes=int(os.getenv('PRICE_STORE_MAX_MB', '512')) * 1024 * 1024)
+
+def get_price_data_version():
+    """The version of the prices the backend reads, which changes whenever they are updated"""
+    if PRICE_BACKEND == 'files':
+        return read_version(PRICE_FILES_DIR)
+    return database.get_price_data_version()
+
+def load_historical_data(symbol, end_date=None):
+    """
+    Return the price history of symbol up to and including end_date.
+    The DataFrame is a read-only view over the price store, all columns are float64.
+    """
+    return price_store.history(symbol, end_date)
 
-@lru_cache(maxsize=128)
 def load_daily_values(symbols, start_date, end_date):
-    # Convert dates to strings and symbols tuple to make it hashable
-    cache_key_symbols = tuple(sorted(symbols))  # Sort to ensure consistent caching
-    cache_key_start_date = start_date.isoformat()
-    cache_key_end_date = end_date.isoformat()
-    return _load_daily_values(cache_key_symbols, cache_key_start_date, cache_key_end_date)
+    """
+    Adjusted closes of symbols on every trading session between start_date and end_date
+    (inclusive), one column per symbol. Each symbol's bars are placed into one float64
+    matrix aligned to the trading calendar; sessions a symbol has no bar for are NaN.
+    """
+    symbols = sorted(set(symbols))
+    sessions = get_trading_calendar().sessions
+    lo = sessions.searchsorted(pd.Timestamp(start_date), side='left')
+    hi = sessions.searchsorted(pd.Timestamp(end_date), side='right')
+    sessions = sessions[lo:hi]
+    session_values = sessions.values
 
-def _load_daily_values(symbols, start_date, end_date):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT date, symbol, adj_close
-                FROM prices
-                WHERE symbol IN %s AND date BETWEEN %s AND %s
-                        
-            """, (tuple(symbols), start_date, end_date))
-            data = cur.fetchall()
-
-    df = pd.DataFrame(data, columns=['date', 'symbol', 'adj_close'])
-    # Pivot the DataFrame to have symbols as columns
-    df_pivoted = df.pivot(index='date', columns='symbol', values='adj_close')
-    return df_pivoted
\ No newline at end of file
+    matrix = np.full((len(sessions), len(symbols)), np.nan)
+    adj_close = PRICE_COLUMNS.index('adj_close')
+    for i, symbol in enumerate(symbols):
+        dates, values = price_store.view(symbol, sessions[-1] if len(sessions) else end_date)
+        rows = dates.searchsorted(session_values)
+        found = rows < len(dates)
+        found[found] = dates[rows[found]] == session_values[found]
+        matrix[found, i] = values[rows[found], adj_close]
+
+    return pd.DataFrame(matrix, index=sessions.rename('date'), columns=pd.Index(symbols, name='symbol'))
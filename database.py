@@ -1,5 +1,10 @@
+import io
 import os
-from psycopg2 import pool
+import threading
+import time
+import numpy as np
+import pandas as pd
+from psycopg2 import errors, pool
 from contextlib import contextmanager
 from dotenv import load_dotenv
 
@@ -14,23 +19,190 @@ DB_PARAMS = {
     'port': os.getenv('DB_PORT')
 }
 
-# Create a connection pool
-connection_pool = pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=20,  # Increased max connections
-    **DB_PARAMS
-)
+# The pool connects on first use, so code that only reads local price files never needs a database
+connection_pool = None
+max_connections = 20
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global connection_pool
+    with _pool_lock:
+        if connection_pool is None:
+            connection_pool = pool.SimpleConnectionPool(minconn=1, maxconn=max_connections, **DB_PARAMS)
+        return connection_pool
+
+def reset_connection_pool(maxconn):
+    """
+    Give a forked worker process its own pool. Connections inherited from the parent
+    share its sockets, so they are dropped without being closed.
+    """
+    global connection_pool, max_connections
+    connection_pool = None
+    max_connections = maxconn
 
 @contextmanager
 def get_db_connection():
     """Context manager for database connections"""
-    conn = connection_pool.getconn()
+    db_pool = _get_pool()
+    conn = db_pool.getconn()
     try:
         yield conn
     finally:
-        connection_pool.putconn(conn)
+        db_pool.putconn(conn)
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+
+def copy_prices(cur, frame):
+    """
+    Upsert rows into prices in bulk. frame has the columns symbol, date and PRICE_COLUMNS.
+    The rows are streamed into a staging table with COPY and merged with a single
+    INSERT ... ON CONFLICT. Returns the number of rows merged.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS prices_staging (
+            symbol TEXT,
+            date DATE,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION,
+            adj_close DOUBLE PRECISION,
+            volume BIGINT
+        ) ON COMMIT DELETE ROWS
+    """)
+
+    buffer = io.StringIO()
+    frame[['symbol', 'date'] + PRICE_COLUMNS].to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d')
+    buffer.seek(0)
+    cur.copy_expert("""
+        COPY prices_staging (symbol, date, open, high, low, close, adj_close, volume)
+        FROM STDIN WITH (FORMAT csv)
+    """, buffer)
+
+    # DISTINCT ON keeps a duplicated (symbol, date) from hitting the same row twice
+    cur.execute("""
+        INSERT INTO prices (symbol, date, open, high, low, close, adj_close, volume)
+        SELECT DISTINCT ON (symbol, date) symbol, date, open, high, low, close, adj_close, volume
+        FROM prices_staging
+        ORDER BY symbol, date
+        ON CONFLICT (symbol, date) DO UPDATE
+        SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+            close = EXCLUDED.close, adj_close = EXCLUDED.adj_close, volume = EXCLUDED.volume
+    """)
+    rows = cur.rowcount
+    if rows:
+        bump_price_data_version(cur)
+    return rows
+
+def bump_price_data_version(cur):
+    """Mark the prices as changed, invalidating anything cached against the old version"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS price_data_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """)
+    cur.execute("""
+        INSERT INTO price_data_version (id, version, updated_at)
+        VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE
+        SET version = price_data_version.version + 1, updated_at = NOW()
+    """)
+
+def get_price_data_version():
+    """The current price data version, 0 if prices have never been ingested through copy_prices"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("SELECT version FROM price_data_version WHERE id = 1")
+            except errors.UndefinedTable:
+                conn.rollback()
+                return 0
+            row = cur.fetchone()
+            conn.rollback() # don't leave the pooled connection idle in a transaction
+            return row[0] if row else 0
+
+# One row of fetch_price_arrays' binary COPY. Every field is fixed width and never NULL, so
+# the whole stream decodes with a single np.frombuffer: a field count, then a byte length
+# and big-endian value per field (the symbol's position in the request, the date as days
+# since 2000-01-01, and PRICE_COLUMNS as float8)
+_COPY_ROW = np.dtype(
+    [('fields', '>i2'), ('symbol_length', '>i4'), ('symbol', '>i4'), ('date_length', '>i4'), ('date', '>i4')]
+    + [field for column in PRICE_COLUMNS for field in ((f'{column}_length', '>i4'), (column, '>f8'))]
+)
+_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+_POSTGRES_EPOCH_DAYS = 10957 # 2000-01-01 in days since 1970-01-01
+_NANOSECONDS_PER_DAY = 86400 * 10**9
+
+def fetch_price_arrays(cur, symbols):
+    """
+    {symbol: (dates, values)} in the price store's format for the symbols with rows in
+    prices, streamed with COPY ... TO STDOUT in binary and decoded without a Python object
+    per row. NULL prices come back as NaN.
+    """
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    columns = ', '.join(f"COALESCE({column}::float8, 'NaN')" for column in PRICE_COLUMNS)
+    query = cur.mogrify(f"""
+        COPY (
+            SELECT array_position(%s::text[], symbol)::int4, date::date, {columns}
+            FROM prices
+            WHERE symbol = ANY(%s)
+            ORDER BY symbol, date
+        ) TO STDOUT WITH (FORMAT binary)
+    """, (symbols, symbols)).decode()
+    buffer = io.BytesIO()
+    cur.copy_expert(query, buffer)
+    data = buffer.getbuffer()
+
+    if bytes(data[:len(_COPY_SIGNATURE)]) != _COPY_SIGNATURE:
+        raise ValueError("Unexpected COPY header")
+    # flags, then the length of a header extension to skip
+    extension = int.from_bytes(data[len(_COPY_SIGNATURE) + 4:len(_COPY_SIGNATURE) + 8], 'big')
+    start = len(_COPY_SIGNATURE) + 8 + extension
+    # the stream ends with a field count of -1
+    rows = np.frombuffer(data[start:len(data) - 2], dtype=_COPY_ROW)
+    if not len(rows):
+        return {}
+    if (rows['fields'] != 2 + len(PRICE_COLUMNS)).any():
+        raise ValueError("Unexpected COPY row layout")
+
+    positions = rows['symbol'].astype(np.int64)
+    dates = ((rows['date'].astype(np.int64) + _POSTGRES_EPOCH_DAYS) * _NANOSECONDS_PER_DAY).view('datetime64[ns]')
+    # the prices are evenly spaced within a row, so they read as one strided (rows, columns)
+    # view starting at the first of them, byte-swapped in a single pass
+    first, second = (_COPY_ROW.fields[column][1] for column in PRICE_COLUMNS[:2])
+    prices = np.lib.stride_tricks.as_strided(
+        rows[PRICE_COLUMNS[0]], shape=(len(rows), len(PRICE_COLUMNS)), strides=(_COPY_ROW.itemsize, second - first), writeable=False
+    )
+    values = prices.astype(np.float64)
+
+    # rows are grouped by symbol, so each symbol is one contiguous slice
+    starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    return {symbols[positions[s] - 1]: (dates[s:e], values[s:e]) for s, e in zip(starts, ends)}
+
+def price_frame(symbol, df):
+    """Flatten a yfinance download of one symbol (columns already renamed) into copy_prices' format"""
+    columns = {}
+    for column in PRICE_COLUMNS:
+        values = df[column]
+        # yfinance returns a (price, ticker) column MultiIndex, even for a single symbol
+        if isinstance(values, pd.DataFrame):
+            values = values.iloc[:, 0]
+        columns[column] = values
+    frame = pd.DataFrame(columns).dropna(how='all')
+    frame['volume'] = frame['volume'].round().astype('Int64')
+    frame.insert(0, 'date', frame.index)
+    frame.insert(0, 'symbol', symbol)
+    return frame
 
 def save_price_data(symbol, df):
+    start = time.time()
+    frame = price_frame(symbol, df)
+
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -38,25 +210,9 @@ def save_price_data(symbol, df):
                 VALUES (%s)
                 ON CONFLICT (symbol) DO NOTHING
             """, (symbol,))
-            
-            for index, row in df.iterrows():
-                cur.execute("""
-                    INSERT INTO prices (symbol, date, open, high, low, close, adj_close, volume)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (symbol, date) DO UPDATE
-                    SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
-                        close = EXCLUDED.close, adj_close = EXCLUDED.adj_close, volume = EXCLUDED.volume
-                """, (
-                    symbol,
-                    index.date(),
-                    float(row['open'].iloc[0]),
-                    float(row['high'].iloc[0]),
-                    float(row['low'].iloc[0]),
-                    float(row['close'].iloc[0]),
-                    float(row['adj_close'].iloc[0]),
-                    int(row['volume'].iloc[0])
-                ))
 
+            rows = copy_prices(cur, frame)
             conn.commit()
 
-    
+    elapsed = time.time() - start
+    print(f"Saved {rows} rows for {symbol} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
@@ -0,0 +1,130 @@
+import decimal
+import numpy as np
+import pandas as pd
+from data_fetcher import price_store
+from price_store import PRICE_COLUMNS
+
+# when a rebalance on date fills its orders:
+# close: the last adjusted close on or before date
+# next_open: the open of the first bar after date, adjusted like the closes are
+# nearest: the adjusted close of the bar dated closest to date, the later one on a tie
+EXECUTION_PRICES = ('close', 'next_open', 'nearest')
+
+class Slippage:
+    """Buys fill bps basis points above the execution price and sells bps below it"""
+
+    def __init__(self, bps=0):
+        self.bps = float(bps)
+
+    def adjust(self, prices, side):
+        if side == 'buy':
+            return prices * (1 + self.bps / 10000)
+        return prices * (1 - self.bps / 10000)
+
+class Commission:
+    """A fixed fee per trade plus bps basis points of the traded value, paid out of cash"""
+
+    def __init__(self, per_trade=0, bps=0):
+        self.per_trade = float(per_trade)
+        self.bps = float(bps)
+
+    def _number(self, value):
+        # decimal accounting stays in Decimal, float64 scalars and arrays of them in float64
+        return decimal.Decimal if isinstance(value, decimal.Decimal) else np.float64
+
+    def fee(self, value):
+        number = self._number(value)
+        return number(self.per_trade) + abs(value) * number(self.bps) / 10000
+
+    def quantity(self, budget, price):
+        """The shares budget buys at price once the fee for buying them has been taken out of it"""
+        number = self._number(budget)
+        if number is np.float64:
+            return np.maximum(budget - number(self.per_trade), 0) / (price * (1 + number(self.bps) / 10000))
+        return max(budget - number(self.per_trade), number(0)) / (price * (1 + number(self.bps) / 10000))
+
+def execution_options(options):
+    """
+    Portfolio keyword arguments for the "execution" object of a backtest payload:
+    {"price": one of EXECUTION_PRICES, "slippage_bps", "commission_per_trade", "commission_bps"}.
+    Raises ValueError or TypeError if it is invalid.
+    """
+    options = options or {}
+    if not isinstance(options, dict):
+        raise ValueError("execution must be an object")
+    unknown = set(options) - {'price', 'slippage_bps', 'commission_per_trade', 'commission_bps'}
+    if unknown:
+        raise ValueError(f"Unknown execution options {sorted(unknown)}")
+    price = options.get('price', 'close')
+    if price not in EXECUTION_PRICES:
+        raise ValueError(f"Unknown execution price {price}, expected one of {EXECUTION_PRICES}")
+
+    costs = {key: float(options.get(key, 0)) for key in ('slippage_bps', 'commission_per_trade', 'commission_bps')}
+    if any(cost < 0 or not np.isfinite(cost) for cost in costs.values()):
+        raise ValueError("execution costs must be non-negative numbers")
+    return {
+        'execution': price,
+        'slippage': Slippage(costs['slippage_bps']) if costs['slippage_bps'] else None,
+        'commission': Commission(costs['commission_per_trade'], costs['commission_bps'])
+        if costs['commission_per_trade'] or costs['commission_bps'] else None,
+    }
+
+class FillPrices:
+    """
+    Execution prices of symbols on every rebalance date as one dates x symbols float64
+    matrix, resolved up front with a single searchsorted per symbol over all the dates.
+    A rebalance then looks up the prices of all its orders in one indexing operation.
+    Dates a symbol has no bar for under the policy are NaN.
+
+    Under next_open a rebalance on or after the last bar has no open to fill at yet;
+    fillable() tells the backtest to leave those out rather than fail on them.
+    """
+
+    def __init__(self, symbols, dates, policy='close'):
+        if policy not in EXECUTION_PRICES:
+            raise ValueError(f"Unknown execution price {policy}, expected one of {EXECUTION_PRICES}")
+        self.policy = policy
+        self.symbols = sorted(symbols)
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._rows = {pd.Timestamp(date): i for i, date in enumerate(dates)}
+        self.matrix = np.full((len(dates), len(self.symbols)), np.nan)
+
+        self.last_bar = None # the latest bar of any of the symbols
+        targets = np.array([pd.Timestamp(date).to_datetime64() for date in dates], dtype='datetime64[ns]')
+        for i, symbol in enumerate(self.symbols):
+            symbol_dates, values = price_store.arrays(symbol)
+            self.matrix[:, i] = self._resolve(symbol_dates, values, targets)
+            if len(symbol_dates) and (self.last_bar is None or symbol_dates[-1] > self.last_bar):
+                self.last_bar = symbol_dates[-1]
+
+    def _resolve(self, dates, values, targets):
+        adj_close = values[:, PRICE_COLUMNS.index('adj_close')]
+        result = np.full(len(targets), np.nan)
+        if len(dates) == 0:
+            return result
+
+        after = dates.searchsorted(targets, side='right') # first bar after each target
+        if self.policy == 'close':
+            found = after > 0
+            result[found] = adj_close[after[found] - 1]
+        elif self.policy == 'next_open':
+            found = after < len(dates)
+            rows = after[found]
+            # opens are raw prices, so scale them by the bar's adjustment to compare with adjusted closes
+            result[found] = values[rows, PRICE_COLUMNS.index('open')] * adj_close[rows] / values[rows, PRICE_COLUMNS.index('close')]
+        else:
+            before = np.maximum(after - 1, 0)
+            later = np.minimum(dates.searchsorted(targets, side='left'), len(dates) - 1)
+            use_later = np.abs(dates[later] - targets) <= np.abs(targets - dates[before])
+            result = adj_close[np.where(use_later, later, before)]
+        return result
+
+    def fillable(self, date):
+        """Whether orders placed on date can be filled with the prices there are"""
+        if self.policy != 'next_open':
+            return True
+        return self.last_bar is not None and np.datetime64(pd.Timestamp(date), 'ns') < self.last_bar
+
+    def prices(self, date, symbols):
+        """The execution prices of symbols for the rebalance on date, as a float64 array"""
+        return self.matrix[self._rows[pd.Timestamp(date)], [self._columns[symbol] for symbol in symbols]]
@@ -133,8 +133,22 @@ export default function BacktestForm({ rules, strategyName }: BacktestFormProps)
         throw new Error('Failed to run backtest');
       }
 
-      const data = await response.json();
-      setBacktestResults(data);
+      // The backtest runs as a job; poll until it finishes
+      const { job_id } = await response.json();
+      let job;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const jobResponse = await fetch(`http://localhost:8000/backtest/${job_id}`);
+        if (!jobResponse.ok) {
+          throw new Error('Failed to fetch backtest status');
+        }
+        job = await jobResponse.json();
+      } while (job.status === 'queued' || job.status === 'running');
+
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+      setBacktestResults(job.result);
     } catch (error) {
       console.error('Error running backtest:', error);
       alert('Error running backtest: ' + (error as Error).message);
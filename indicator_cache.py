@@ -0,0 +1,54 @@
+import threading
+from bounded_lru import BoundedLRU
+
+class IndicatorCache:
+    """
+    Indicator series shared by every IndicatorEngine in the process, so strategies and
+    requests asking for the same (indicator, symbol, params) compute it once per price
+    data version.
+
+    Entries are (dates, values) over the symbol's full history, and are evicted least
+    recently used first once they exceed max_bytes. The dates are the cache's own copy,
+    counted in that budget, so an entry never keeps arrays the price store has evicted
+    alive. All entries are dropped when the price data version moves on.
+    """
+
+    def __init__(self, max_bytes):
+        self.data_version = None
+        self._entries = BoundedLRU(
+            max_bytes,
+            sizeof=lambda entry: entry[0].nbytes + entry[1].nbytes,
+            keep_last=True,
+        ) # (indicator_func, symbol, params): (dates, values)
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._entries.max_bytes
+
+    def set_data_version(self, data_version):
+        """Record the current price data version, clearing the cache if it changed"""
+        with self._lock:
+            if data_version != self.data_version:
+                self._entries.clear()
+                self.data_version = data_version
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, dates, values):
+        """Store a series and return the (dates, values) held for it"""
+        # every engine reads the same array, so nobody gets to modify it in place
+        values.flags.writeable = False
+        return self._entries.put(key, (dates.copy(deep=True), values))
+
+    def evict_symbol(self, symbol):
+        """Drop every indicator computed over symbol, e.g. after its prices were refreshed"""
+        self._entries.pop_where(lambda key: key[1] == symbol)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._entries.stats(), 'data_version': self.data_version}
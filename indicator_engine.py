@@ -0,0 +1,173 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from data_fetcher import load_historical_data
+from indicator_cache import IndicatorCache
+from indicators import atr, atr_percent, current_price, series_map, sma_cross, vix
+from streaming_indicators import Streaming, streaming_map
+
+def close_mean_series(df, period):
+    """Rolling mean of the close: sma_cross and vix, which pandas_ta's sma (sma_price) differs from in the last bit"""
+    return df['close'].rolling(window=period).mean()
+
+# Indicators that are computed from other cached series instead of from scratch:
+# indicator -> function(series, df, *params), where series(func, *params) returns the values
+# of another indicator, or of a helper series function, over the same symbol's history
+derived_series = {
+    atr_percent: lambda series, df, period: series(atr, period) / df['close'].to_numpy(),
+    sma_cross: lambda series, df, fast_period, slow_period: series(close_mean_series, fast_period) / series(close_mean_series, slow_period),
+    vix: lambda series, df, period=None: series(close_mean_series, period) if period else series(current_price),
+}
+
+# Shared by every engine in the process; see IndicatorCache
+indicator_cache = IndicatorCache(max_bytes=int(os.getenv('INDICATOR_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+class IndicatorEngine:
+    """
+    Computes each (indicator, symbol, params) series once over the full price history
+    and answers point-in-time lookups by index.
+
+    The indicators only look backwards, so the value at a date is identical to calling
+    the indicator function with that date as end_date. Series are shared with other
+    engines through cache, and indicators in derived_series reuse the series they are
+    built from.
+    """
+
+    def __init__(self, cache=indicator_cache):
+        self.cache = cache
+        self._series = {} # (indicator_func, symbol, params): (dates, values, required_rows)
+
+    def series(self, indicator_func, symbol, params):
+        """Return (dates, values, required_rows) for an indicator, computing it on first use"""
+        params = tuple(params)
+        key = (indicator_func, symbol, params)
+        if key not in self._series:
+            if indicator_func not in series_map:
+                raise ValueError(f"Indicator {indicator_func.__name__} has no series implementation")
+            _, required_rows, data_symbol = series_map[indicator_func]
+            dates, values = self._history(indicator_func, data_symbol or symbol, params)
+            self._series[key] = (dates, values, required_rows(*params))
+        return self._series[key]
+
+    def _history(self, indicator_func, data_symbol, params):
+        """(dates, values) of an indicator over data_symbol's full history, from the cache if it has them"""
+        key = (indicator_func, data_symbol, params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        df = load_historical_data(data_symbol)
+        if indicator_func in derived_series:
+            series = lambda func, *func_params: self._history(func, data_symbol, func_params)[1]
+            values = derived_series[indicator_func](series, df, *params)
+        elif indicator_func in series_map:
+            values = series_map[indicator_func][0](df, *params)
+        else: # a helper series function like close_mean_series
+            values = indicator_func(df, *params)
+        if values is None: # pandas_ta returns None when the whole history is too short
+            values = np.full(len(df), np.nan)
+        values = np.array(values, dtype=float)
+
+        if self.cache is not None:
+            return self.cache.put(key, df.index, values)
+        return df.index, values
+
+    def value(self, indicator_func, symbol, params, end_date):
+        """Return the indicator value using only data up to and including end_date"""
+        dates, values, required_rows = self.series(indicator_func, symbol, params)
+        # number of rows on or before end_date, i.e. len(load_historical_data(symbol, end_date))
+        available = dates.searchsorted(pd.Timestamp(end_date), side='right')
+        if available < required_rows:
+            print(f"Warning: Not enough data points for {symbol} {indicator_func.__name__} calculation. Need {required_rows} days, but only have {available}. Skipping...")
+            return None
+        return values[available - 1]
+
+    def values(self, indicator_func, symbol, params, end_dates):
+        """
+        Vectorized value() over many end dates. Returns (values, valid) arrays, where valid
+        is False wherever value() would return None
+        """
+        dates, values, required_rows = self.series(indicator_func, symbol, params)
+        available = dates.searchsorted(pd.DatetimeIndex(end_dates), side='right')
+        valid = available >= max(required_rows, 1)
+        result = np.full(len(available), np.nan)
+        result[valid] = values[available[valid] - 1]
+        return result, valid
+
+    def panel(self, requests, end_dates):
+        """
+        values() for many IndicatorRequests at once, as end_dates x requests (values, valid)
+        arrays. NaN and inf values are not valid.
+        """
+        end_dates = pd.DatetimeIndex(end_dates)
+        values = np.full((len(end_dates), len(requests)), np.nan)
+        valid = np.zeros(values.shape, dtype=bool)
+        for j, request in enumerate(requests):
+            values[:, j], valid[:, j] = self.values(request.func, request.symbol, request.params, end_dates)
+        valid &= np.isfinite(values)
+        return values, valid
+
+class StreamingEngine:
+    """
+    The IndicatorEngine interface backed by streaming indicators, for live signals. Each
+    indicator remembers the date of the last bar it was fed, so a daily run only feeds it
+    the bars added since, and the state can be saved between runs with to_dict. Indicators
+    without a streaming version, and dates before an indicator's last bar, are answered
+    by an IndicatorEngine instead.
+    """
+
+    def __init__(self, state=None):
+        self._indicators = {} # key: (date of the last bar fed, streaming indicator)
+        for key, entry in (state or {}).items():
+            self._indicators[key] = (pd.Timestamp(entry['date']), Streaming.from_dict(entry['indicator']))
+        self._batch = IndicatorEngine()
+
+    @staticmethod
+    def _key(indicator_func, symbol, params):
+        return json.dumps([indicator_func.__name__, symbol, list(params)])
+
+    def value(self, indicator_func, symbol, params, end_date):
+        """Return the indicator value using only data up to and including end_date"""
+        key = self._key(indicator_func, symbol, params)
+        last_date, indicator = self._indicators.get(key, (None, None))
+        end_date = pd.Timestamp(end_date)
+        if indicator_func not in streaming_map or (last_date is not None and last_date > end_date):
+            return self._batch.value(indicator_func, symbol, params, end_date)
+
+        _, required_rows, data_symbol = series_map[indicator_func]
+        df = load_historical_data(data_symbol or symbol, end_date)
+        if indicator is None:
+            indicator = streaming_map[indicator_func](*params)
+        new_bars = df if last_date is None else df[df.index > last_date]
+        for row in new_bars.to_numpy():
+            indicator.update(dict(zip(new_bars.columns, row)))
+        if len(new_bars):
+            last_date = new_bars.index[-1]
+        self._indicators[key] = (last_date, indicator)
+
+        if len(df) < required_rows(*params):
+            print(f"Warning: Not enough data points for {symbol} {indicator_func.__name__} calculation. Need {required_rows(*params)} days, but only have {len(df)}. Skipping...")
+            return None
+        return indicator.value
+
+    def panel(self, requests, end_dates):
+        """IndicatorEngine.panel, one value() per request and end date"""
+        end_dates = pd.DatetimeIndex(end_dates)
+        values = np.full((len(end_dates), len(requests)), np.nan)
+        valid = np.zeros(values.shape, dtype=bool)
+        for i, end_date in enumerate(end_dates):
+            for j, request in enumerate(requests):
+                value = self.value(request.func, request.symbol, request.params, end_date)
+                if value is not None:
+                    values[i, j] = value
+                    valid[i, j] = True
+        valid &= np.isfinite(values)
+        return values, valid
+
+    def to_dict(self):
+        return {
+            key: {'date': last_date.strftime('%Y-%m-%d'), 'indicator': indicator.to_dict()}
+            for key, (last_date, indicator) in self._indicators.items() if last_date is not None
+        }
@@ -2,97 +2,143 @@ import pandas as pd
 import pandas_ta as ta
 from data_fetcher import load_historical_data
 
+# Each *_series function computes an indicator over every row of df. Every indicator
+# only looks backwards, so the value at row i equals the point-in-time function called
+# with end_date set to that row's date.
+
+def rsi_series(df, period):
+    return df.ta.rsi(length=period)
+
 def rsi(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} RSI calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.rsi(length=period).iloc[-1]
+    result = rsi_series(df, period).iloc[-1]
     return result
 
+def ema_series(df, period):
+    return df.ta.ema(length=period)
+
 def ema(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} EMA calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.ema(length=period).iloc[-1]
+    result = ema_series(df, period).iloc[-1]
     return result
 
+def macd_series(df, fast_period, slow_period, signal_period):
+    result = df.ta.macd(fast=fast_period, slow=slow_period, signal=signal_period)
+    return None if result is None else result.iloc[:, 0]
+
 def macd(symbol, end_date, fast_period, slow_period, signal_period):
     df = load_historical_data(symbol, end_date)
     if len(df) < max(fast_period, slow_period, signal_period):
         print(f"Warning: Not enough data points for {symbol} MACD calculation. Need {max(fast_period, slow_period, signal_period)} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.macd(fast=fast_period, slow=slow_period, signal=signal_period).iloc[-1].iloc[0]
+    result = macd_series(df, fast_period, slow_period, signal_period).iloc[-1]
     return result
 
+def sma_price_series(df, period):
+    return df.ta.sma(length=period)
+
 def sma_price(symbol, end_date, period):
     print(f"Calculating SMA for {symbol} with period {period} and end date {end_date}")
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} SMA price calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.sma(length=period).iloc[-1]
+    result = sma_price_series(df, period).iloc[-1]
     return result
 
+def fibonacci_retracement_series(df, period):
+    high = df['high'].rolling(window=period).max()
+    low = df['low'].rolling(window=period).min()
+    current = df['close']
+    return ((high - current) / (high - low))
+
 def fibonacci_retracement(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} fibonacci retracement calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    high = df['high'].rolling(window=period).max().iloc[-1]
-    low = df['low'].rolling(window=period).min().iloc[-1]
-    current = df['close'].iloc[-1]
-    retracement = ((high - current) / (high - low))
+    retracement = fibonacci_retracement_series(df, period).iloc[-1]
     return retracement
 
+def adx_series(df, period):
+    result = df.ta.adx(length=period)
+    return None if result is None else result.iloc[:, 0]
+
 def adx(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} ADX calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.adx(length=period).iloc[-1].iloc[0]
+    result = adx_series(df, period).iloc[-1]
     return result
 
+def standard_deviation_price_series(df, period):
+    return df['close'].rolling(window=period).std()
+
 def standard_deviation_price(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} standard deviation price calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df['close'].rolling(window=period).std().iloc[-1]
+    result = standard_deviation_price_series(df, period).iloc[-1]
     return result
 
+def stochastic_oscillator_series(df, period):
+    result = df.ta.stoch(k=period, d=3, smooth_k=3)
+    return None if result is None else result.iloc[:, 0]
+
 def stochastic_oscillator(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} stochastic oscillator calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.stoch(k=period, d=3, smooth_k=3).iloc[-1].iloc[0]
+    result = stochastic_oscillator_series(df, period).iloc[-1]
     return result
 
+def sma_return_series(df, period):
+    returns = df['close'].pct_change()
+    return returns.rolling(window=period).mean()
+
 def sma_return(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} SMA return calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    returns = df['close'].pct_change()
-    result = returns.rolling(window=period).mean().iloc[-1]
+    result = sma_return_series(df, period).iloc[-1]
     return result
 
+def standard_deviation_return_series(df, period):
+    returns = df['close'].pct_change()
+    return returns.rolling(window=period).std()
+
 def standard_deviation_return(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} standard deviation return calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    returns = df['close'].pct_change()
-    result = returns.rolling(window=period).std().iloc[-1]
+    result = standard_deviation_return_series(df, period).iloc[-1]
     return result
 
+def max_drawdown_series(df, period=None):
+    if period is None:
+        # the point-in-time version uses the whole history as its window, so only the
+        # drawdown of the last close from the running max survives
+        running_max = df['close'].cummax()
+        return (df['close'] - running_max) / running_max
+    max_in_window = df['close'].rolling(window=period).max()
+    return ((df['close'] - max_in_window) / max_in_window).cummin()
+
 def max_drawdown(symbol, end_date, period=None):
     df = load_historical_data(symbol, end_date)
     if period is None:
         period = len(df)
-    
+
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} max drawdown calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
@@ -102,31 +148,46 @@ def max_drawdown(symbol, end_date, period=None):
     result = ((df['close'] - max_in_window) / max_in_window).min()
     return result
 
+def current_price_series(df):
+    return df['close']
+
 def current_price(symbol, end_date):
     df = load_historical_data(symbol, end_date)
     result = df['close'].iloc[-1]
     return result
 
+def cumulative_return_series(df, period):
+    start_price = df['close'].shift(period - 1)
+    end_price = df['close']
+    return ((end_price - start_price) / start_price)
+
 def cumulative_return(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     # Skip calculation if we don't have enough data points
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} cumulative return calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    
+
     start_price = df['close'].iloc[-period]
     end_price = df['close'].iloc[-1]
     result = ((end_price - start_price) / start_price)
     return result
 
+def atr_series(df, period):
+    return df.ta.atr(length=period)
+
 def atr(symbol, end_date, period):
     df = load_historical_data(symbol, end_date)
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} ATR calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    result = df.ta.atr(length=period).iloc[-1]
+    result = atr_series(df, period).iloc[-1]
     return result
 
+def atr_percent_series(df, period):
+    # Calculate ATR as percentage of price
+    return atr_series(df, period) / df['close']
+
 def atr_percent(symbol, end_date, period):
     """
     Calculate ATR as a percentage of price to normalize across different price levels
@@ -135,15 +196,13 @@ def atr_percent(symbol, end_date, period):
     if len(df) < period:
         print(f"Warning: Not enough data points for {symbol} ATR percent calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    
-    # Calculate ATR
-    atr_value = df.ta.atr(length=period)
-    # Get current price
-    current_price = df['close']
-    # Calculate ATR as percentage of price
-    atr_pct = (atr_value / current_price)
-    
-    return atr_pct.iloc[-1]
+
+    return atr_percent_series(df, period).iloc[-1]
+
+def vix_series(df, period=None):
+    if period:
+        return df['close'].rolling(window=period).mean()
+    return df['close']
 
 def vix(symbol, end_date, period=None):
     """
@@ -154,11 +213,12 @@ def vix(symbol, end_date, period=None):
         if len(df) < period:
             print(f"Warning: Not enough data points for VIX calculation. Need {period} days, but only have {len(df)}. Skipping...")
             return None
-        result = df['close'].rolling(window=period).mean().iloc[-1]
-    else:
-        result = df['close'].iloc[-1]
+    result = vix_series(df, period).iloc[-1]
     return result
 
+def vix_change_series(df, period):
+    return df['close'] - df['close'].shift(period - 1)
+
 def vix_change(symbol, end_date, period):
     """
     Calculate how much VIX has changed over the last N days
@@ -168,11 +228,16 @@ def vix_change(symbol, end_date, period):
     if len(df) < period:
         print(f"Warning: Not enough data points for VIX change calculation. Need {period} days, but only have {len(df)}. Skipping...")
         return None
-    
+
     current_vix = df['close'].iloc[-1]
     past_vix = df['close'].iloc[-period]
     return current_vix - past_vix
 
+def sma_cross_series(df, fast_period, slow_period):
+    fast_sma = df['close'].rolling(window=fast_period).mean()
+    slow_sma = df['close'].rolling(window=slow_period).mean()
+    return fast_sma / slow_sma
+
 def sma_cross(symbol, end_date, fast_period, slow_period):
     """
     Calculate if fast SMA is above slow SMA
@@ -182,9 +247,29 @@ def sma_cross(symbol, end_date, fast_period, slow_period):
     if len(df) < max(fast_period, slow_period):
         print(f"Warning: Not enough data points for {symbol} SMA cross calculation. Need {max(fast_period, slow_period)} days, but only have {len(df)}. Skipping...")
         return None
-    
-    fast_sma = df['close'].rolling(window=fast_period).mean()
-    slow_sma = df['close'].rolling(window=slow_period).mean()
-    
+
     # Return ratio of fast to slow SMA (> 1 means bullish, < 1 means bearish)
-    return (fast_sma / slow_sma).iloc[-1]
+    return sma_cross_series(df, fast_period, slow_period).iloc[-1]
+
+# indicator -> (series function, rows needed before a value is returned, symbol to load
+# instead of the requested one). Used by IndicatorEngine to precompute whole histories.
+series_map = {
+    rsi: (rsi_series, lambda period: period, None),
+    ema: (ema_series, lambda period: period, None),
+    macd: (macd_series, lambda fast_period, slow_period, signal_period: max(fast_period, slow_period, signal_period), None),
+    sma_price: (sma_price_series, lambda period: period, None),
+    fibonacci_retracement: (fibonacci_retracement_series, lambda period: period, None),
+    adx: (adx_series, lambda period: period, None),
+    standard_deviation_price: (standard_deviation_price_series, lambda period: period, None),
+    stochastic_oscillator: (stochastic_oscillator_series, lambda period: period, None),
+    sma_return: (sma_return_series, lambda period: period, None),
+    standard_deviation_return: (standard_deviation_return_series, lambda period: period, None),
+    max_drawdown: (max_drawdown_series, lambda period=None: period or 1, None),
+    current_price: (current_price_series, lambda: 1, None),
+    cumulative_return: (cumulative_return_series, lambda period: period, None),
+    atr: (atr_series, lambda period: period, None),
+    atr_percent: (atr_percent_series, lambda period: period, None),
+    vix: (vix_series, lambda period=None: period or 1, '^VIX'),
+    vix_change: (vix_change_series, lambda period: period, '^VIX'),
+    sma_cross: (sma_cross_series, lambda fast_period, slow_period: max(fast_period, slow_period), None),
+}
@@ -0,0 +1,270 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import database
+import data_fetcher
+import trading_system
+from backtesting import Portfolio
+from batch import run_batch
+from benchmark import dca_values
+from execution import execution_options
+from indicator_engine import indicator_cache
+from prefetch import prefetch
+from result_cache import cache_key
+from serialization import backtest_response
+
+class QueueFullError(Exception):
+    pass
+
+class WorkerPoolError(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'queued' # queued, running, done or failed
+        self.progress = 0.0
+        self.result = None # response JSON once done
+        self.error = None
+        self.updated_at = time.time()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+        }
+
+    def response_json(self):
+        """The job status with the backtest response embedded under 'result', without re-parsing it"""
+        status = json.dumps(self.to_dict())
+        if self.result is None:
+            return status
+        return f'{status[:-1]}, "result": {self.result}}}'
+
+def _init_worker(db_connections):
+    database.reset_connection_pool(db_connections)
+
+_data_version = None
+
+def _refresh_price_caches(data_version):
+    # a worker keeps prices between jobs, so drop them once the DPU has ingested new bars
+    global _data_version
+    if data_version != _data_version:
+        data_fetcher.price_store.clear()
+        data_fetcher.get_earliest_date.cache_clear()
+        data_fetcher.get_trading_calendar.cache_clear()
+        trading_system._compile_rules_json.cache_clear()
+        dca_values.cache_clear()
+        _data_version = data_version
+    indicator_cache.set_data_version(data_version)
+
+def run_backtest_job(job_id, payload, progress_queue, data_version=None):
+    """
+    Run one /backtest payload in a worker process. Returns the response JSON, and the
+    worker's process id and indicator cache stats for JobManager.stats
+    """
+    progress_queue.put((job_id, 0.0))
+    _refresh_price_caches(data_version)
+    prefetch(payload)
+
+    start_date = datetime.strptime(payload["start_date"], "%Y-%m-%d")
+    end_date = datetime.strptime(payload["end_date"], "%Y-%m-%d")
+    starting_capital = float(payload["starting_capital"])
+    monthly_investment = float(payload["monthly_investment"])
+
+    portfolio = Portfolio(
+        starting_capital, monthly_investment, payload, end_date, start_date,
+        rebalance=payload.get("rebalance", "monthly"),
+        contribution_schedule=payload.get("contribution_schedule", "monthly"),
+        **execution_options(payload.get("execution")),
+    )
+    portfolio.backtest(progress=lambda completed, total: progress_queue.put((job_id, completed / total)))
+    return backtest_response(portfolio, payload.get('layout', 'records')), os.getpid(), indicator_cache.stats()
+
+def run_batch_job(job_id, payload, progress_queue, data_version=None):
+    """run_backtest_job for a /backtest/batch payload, whose strategies have been resolved to rules documents"""
+    progress_queue.put((job_id, 0.0))
+    _refresh_price_caches(data_version)
+
+    response = run_batch(
+        payload["strategies"],
+        datetime.strptime(payload["start_date"], "%Y-%m-%d"),
+        datetime.strptime(payload["end_date"], "%Y-%m-%d"),
+        float(payload["starting_capital"]),
+        float(payload["monthly_investment"]),
+        rebalance=payload.get("rebalance", "monthly"),
+        contribution_schedule=payload.get("contribution_schedule", "monthly"),
+        execution=payload.get("execution"),
+        layout=payload.get("layout", "records"),
+        progress=lambda completed, total: progress_queue.put((job_id, completed / total)),
+    )
+    return response, os.getpid(), indicator_cache.stats()
+
+class JobManager:
+    """
+    Runs backtests on a bounded process pool. At most max_active jobs may be queued or
+    running at once, and each worker holds at most db_connections database connections.
+    Finished jobs are kept for polling until max_finished newer ones have completed.
+
+    With a ResultCache, a payload that was already backtested against the current price
+    data is answered from the cache, and one identical to a queued or running job joins it.
+    """
+
+    def __init__(self, workers, max_active, db_connections, max_finished=100, cache=None):
+        self.workers = workers
+        self.max_active = max_active
+        self.db_connections = db_connections
+        self.max_finished = max_finished
+        self.cache = cache
+        self._jobs = OrderedDict() # job_id: Job
+        self._pending = {} # cache key: queued or running Job
+        self._indicator_stats = {} # worker pid: its indicator cache stats after its last job
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress_queue = None
+
+    def _start(self):
+        # started on first use so importing api.py does not spawn processes
+        if self._progress_queue is None:
+            self._progress_queue = multiprocessing.Manager().Queue()
+            threading.Thread(target=self._read_progress, daemon=True).start()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.db_connections,),
+            )
+
+    def _discard_executor(self, executor):
+        # a worker that dies mid-job (killed for memory, a crash in a C extension) breaks the
+        # whole pool, so drop it and let _start create a new one. A broken pool has already
+        # terminated its processes, and shutting it down from a done callback would deadlock.
+        # The progress queue lives in the manager process, which a dead worker doesn't take down
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def _submit(self, run, job, payload, data_version):
+        """Submit a job to the pool, replacing the pool once if it is broken. Returns the pool and the future"""
+        for _ in range(2):
+            with self._lock:
+                self._start()
+                executor = self._executor
+            try:
+                return executor, executor.submit(run, job.id, payload, self._progress_queue, data_version)
+            except BrokenProcessPool:
+                print("Backtest worker pool is broken, restarting it")
+                self._discard_executor(executor)
+        raise WorkerPoolError("The backtest workers could not be restarted, try again later")
+
+    def submit(self, payload, run=run_backtest_job):
+        """
+        Queue payload to be run by run (run_backtest_job or run_batch_job) and return its Job.
+        Raises QueueFullError if max_active jobs are already waiting, or WorkerPoolError if
+        the process pool is broken and can't be replaced.
+        """
+        key = data_version = None
+        if self.cache is not None:
+            data_version = data_fetcher.get_price_data_version()
+            self.cache.set_data_version(data_version)
+            key = cache_key(payload, data_version)
+
+        with self._lock:
+            if key is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    job = Job(uuid.uuid4().hex)
+                    job.status = 'done'
+                    job.progress = 1.0
+                    job.result = cached
+                    self._jobs[job.id] = job
+                    self._prune()
+                    return job
+                if key in self._pending:
+                    return self._pending[key]
+
+            active = sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+            if active >= self.max_active:
+                raise QueueFullError(f"{active} backtests are already queued or running, try again later")
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._pending[key] = job
+            self._prune()
+
+        try:
+            executor, future = self._submit(run, job, payload, data_version)
+        except Exception as e:
+            # never leave a job queued that no worker will run, nor others joining it
+            with self._lock:
+                job.status = 'failed'
+                job.error = str(e)
+                self._jobs.pop(job.id, None)
+                if key is not None and self._pending.get(key) is job:
+                    del self._pending[key]
+            raise
+        future.add_done_callback(lambda future: self._finish(job, future, key, data_version, executor))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            indicator_stats = list(self._indicator_stats.values())
+        stats = {status: statuses.count(status) for status in ('queued', 'running', 'done', 'failed')}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        # summed over the workers, each of which has its own cache
+        stats['indicator_cache'] = {
+            name: sum(worker[name] for worker in indicator_stats)
+            for name in ('entries', 'bytes', 'hits', 'misses', 'evictions')
+        }
+        return stats
+
+    def _read_progress(self):
+        while True:
+            try:
+                job_id, progress = self._progress_queue.get()
+            except (EOFError, OSError):
+                return # the manager process has shut down
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and job.status in ('queued', 'running'):
+                    job.status = 'running'
+                    job.progress = progress
+                    job.updated_at = time.time()
+
+    def _finish(self, job, future, key=None, data_version=None, executor=None):
+        if executor is not None and not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._discard_executor(executor)
+        with self._lock:
+            try:
+                job.result, pid, self._indicator_stats[pid] = future.result()
+                job.status = 'done'
+                job.progress = 1.0
+            except Exception as e:
+                print(f"Backtest {job.id} failed: {e}")
+                job.status = 'failed'
+                job.error = str(e)
+            job.updated_at = time.time()
+            if key is not None:
+                self._pending.pop(key, None)
+                if job.status == 'done':
+                    self.cache.put(key, job.result, data_version)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
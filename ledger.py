@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+class Ledger:
+    """
+    Daily share positions and cash of a portfolio, stored as a dense dates x symbols
+    float64 array plus a cash vector.
+
+    Rows are only written on the dates something changes. Every other date carries the
+    last recorded row forward, and dates before the first record hold no shares and
+    initial_cash.
+    """
+
+    def __init__(self, dates, initial_cash):
+        self.dates = pd.DatetimeIndex(dates)
+        self.initial_cash = float(initial_cash)
+        self.symbols = []
+        self._columns = {} # symbol: column in shares
+        self._positions = {date: i for i, date in enumerate(self.dates)}
+        self._shares = np.zeros((len(self.dates), 0))
+        self._cash = np.full(len(self.dates), np.nan)
+        self._recorded = np.zeros(len(self.dates), dtype=bool)
+
+    def record(self, date, holdings, cash):
+        """Set the positions held at the close of date. Symbols missing from holdings hold 0"""
+        i = self._positions[pd.Timestamp(date).normalize()]
+        for symbol in holdings:
+            self._column(symbol)
+        self._shares[i] = 0
+        for symbol, shares in holdings.items():
+            self._shares[i, self._columns[symbol]] = float(shares)
+        self._cash[i] = float(cash)
+        self._recorded[i] = True
+
+    def _column(self, symbol):
+        if symbol not in self._columns:
+            self._columns[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self._shares = np.hstack([self._shares, np.zeros((len(self.dates), 1))])
+        return self._columns[symbol]
+
+    def _filled_rows(self):
+        # index of the last recorded row on or before each date, -1 before the first record
+        rows = np.where(self._recorded, np.arange(len(self.dates)), -1)
+        return np.maximum.accumulate(rows) if len(rows) else rows
+
+    def shares(self):
+        """Forward-filled positions as a dates x symbols array"""
+        rows = self._filled_rows()
+        shares = self._shares[np.maximum(rows, 0)]
+        shares[rows < 0] = 0
+        return shares
+
+    def cash(self):
+        """Forward-filled cash balance per date"""
+        rows = self._filled_rows()
+        cash = self._cash[np.maximum(rows, 0)]
+        cash[rows < 0] = self.initial_cash
+        return cash
+
+    def values(self, prices):
+        """
+        Total value per date, given prices as a DataFrame indexed by date with a column per
+        symbol. Symbols with no shares on a date contribute nothing even if unpriced.
+        """
+        prices = prices.copy()
+        prices.index = pd.to_datetime(prices.index)
+        prices = prices.reindex(index=self.dates, columns=self.symbols).to_numpy(dtype=np.float64)
+
+        shares = self.shares()
+        holdings = np.where(shares != 0, shares * prices, 0.0)
+        return holdings.sum(axis=1) + self.cash()
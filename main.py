@@ -1,9 +1,37 @@
 from trading_system import load_rules, run_trading_system
+from data_fetcher import get_trading_calendar
+from indicator_engine import StreamingEngine
+from prefetch import prefetch
+import json
+import os
 import time
 
+# Streaming indicator state carried between daily runs, so each run only feeds in the bars
+# added since the last one. Delete it to rebuild the indicators from the full history.
+LIVE_STATE_FILE = os.getenv('LIVE_STATE_FILE', 'live_state.json')
+
+def load_engine(path):
+    if not os.path.exists(path):
+        return StreamingEngine()
+    with open(path) as f:
+        return StreamingEngine(json.load(f))
+
+def save_engine(engine, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(engine.to_dict(), f)
+    os.replace(path + '.tmp', path)
+
 if __name__ == "__main__":
     start_time = time.time()
     rules = load_rules('rules.json')
-    run_trading_system(rules)
+    prefetch(rules)
+
+    # today's signal is for the last session with prices
+    end_date = get_trading_calendar().sessions[-1].to_pydatetime()
+    engine = load_engine(LIVE_STATE_FILE)
+    transactions = run_trading_system(rules, end_date, engine)
+    save_engine(engine, LIVE_STATE_FILE)
+
+    print(f"Signal for {end_date.date()}: {transactions}")
     end_time = time.time()
     print(f"Total execution time: {end_time - start_time:.2f} seconds")
@@ -0,0 +1,158 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import pandas as pd
+import yfinance as yf
+from termcolor import colored
+import data_fetcher
+from benchmark import dca_values
+from database import get_db_connection, copy_prices, fetch_price_arrays, price_frame
+from indicator_engine import indicator_cache
+from indicators import series_map
+from price_files import has_price_file
+from trading_system import compile_node
+
+# at most this many symbols are downloaded at once
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+# a symbol whose last bar is older than this many days is refreshed before the backtest
+PREFETCH_STALE_DAYS = int(os.getenv('PREFETCH_STALE_DAYS', '5'))
+
+def rules_symbols(rules):
+    """Every symbol a rules document needs prices for, found without touching the database"""
+    requests = set()
+    symbols = set()
+    compile_node(rules['rules'], requests, symbols)
+    for request in requests:
+        data_symbol = series_map[request.func][2]
+        symbols.add(data_symbol or request.symbol)
+    # the benchmark, and the trading calendar
+    symbols.add('SPY')
+    return sorted(symbols)
+
+def last_dates(symbols):
+    """{symbol: date of its last bar} for the symbols that have rows in prices, in one query"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT symbol, MAX(date)
+                FROM prices
+                WHERE symbol = ANY(%s)
+                GROUP BY symbol
+            """, (list(symbols),))
+            return dict(cur.fetchall())
+
+def download(symbol, start=None):
+    """
+    Download symbol's bars from start (its whole history if None) in copy_prices' format.
+    Uses a Ticker per call because yf.download shares state between threads.
+    """
+    if start is None:
+        df = yf.Ticker(symbol).history(period='max', auto_adjust=False)
+    else:
+        df = yf.Ticker(symbol).history(start=start, auto_adjust=False)
+    if df.empty:
+        raise ValueError(f"No data found for symbol: {symbol}")
+
+    df.index = pd.DatetimeIndex(df.index).tz_localize(None).normalize()
+    df = df.rename(columns={"Open": "open", "High": "high", "Low": "low", "Close": "close", "Adj Close": "adj_close", "Volume": "volume"})
+    return price_frame(symbol, df)
+
+def save_frames(frames):
+    """Write downloaded frames to the database in one transaction. Returns the number of rows merged"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO symbols (symbol)
+                VALUES (%s)
+                ON CONFLICT (symbol) DO NOTHING
+            """, [(symbol,) for symbol in frames])
+            rows = copy_prices(cur, pd.concat(frames.values()))
+            conn.commit()
+    return rows
+
+def load_prices(symbols):
+    """Load the full histories of symbols into the price store with one binary COPY"""
+    if not symbols:
+        return
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            arrays = fetch_price_arrays(cur, symbols)
+        conn.rollback()
+    for symbol, (dates, values) in arrays.items():
+        data_fetcher.price_store.put(symbol, dates, values)
+
+def prefetch_symbols(symbols, workers=PREFETCH_WORKERS):
+    """
+    Make sure symbols are in the database and up to date, then load them into the price
+    store, so a backtest never stops to download. Returns the seconds spent per phase.
+    """
+    timings = {}
+    files = data_fetcher.PRICE_BACKEND == 'files'
+
+    # with local price files only the symbols without a file involve the database
+    if files:
+        start = time.time()
+        on_disk = [symbol for symbol in symbols if has_price_file(data_fetcher.PRICE_FILES_DIR, symbol)]
+        for symbol in on_disk:
+            data_fetcher.price_store.arrays(symbol)
+        timings['files'] = time.time() - start
+        symbols = [symbol for symbol in symbols if symbol not in on_disk]
+        if not symbols:
+            print(colored(f"Prefetched {len(on_disk)} symbols from price files in {timings['files']:.2f}s", 'green'))
+            return timings
+
+    start = time.time()
+    last = last_dates(symbols)
+    cutoff = (datetime.now() - timedelta(days=PREFETCH_STALE_DAYS)).date()
+    missing = [symbol for symbol in symbols if symbol not in last]
+    stale = [symbol for symbol in symbols if symbol in last and last[symbol] < cutoff]
+    timings['check'] = time.time() - start
+
+    start = time.time()
+    frames = {}
+    if missing or stale:
+        print(colored(f"Downloading {len(missing)} missing and {len(stale)} stale symbols", 'blue'))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(download, symbol, last.get(symbol)): symbol for symbol in missing + stale}
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    frames[symbol] = future.result()
+                except Exception as e:
+                    # the backtest reports missing symbols when it loads them
+                    print(colored(f"Error downloading {symbol}: {e}", 'red'))
+    timings['download'] = time.time() - start
+
+    start = time.time()
+    if frames:
+        rows = save_frames(frames)
+        print(f"Saved {rows} rows for {len(frames)} symbols")
+        # refreshed symbols are reloaded below
+        for symbol in frames:
+            data_fetcher.price_store.evict(symbol)
+            indicator_cache.evict_symbol(symbol)
+        data_fetcher.get_earliest_date.cache_clear()
+        data_fetcher.get_trading_calendar.cache_clear()
+        dca_values.cache_clear()
+    timings['save'] = time.time() - start
+
+    start = time.time()
+    unloaded = [symbol for symbol in symbols if symbol not in data_fetcher.price_store]
+    if files:
+        # the loader writes each symbol's price file as it reads it from the database
+        for symbol in unloaded:
+            data_fetcher.price_store.arrays(symbol)
+    else:
+        load_prices(unloaded)
+    timings['load'] = time.time() - start
+
+    print(colored("Prefetched {} symbols: {}".format(len(symbols), ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items())), 'green'))
+    return timings
+
+def prefetch(rules, workers=PREFETCH_WORKERS):
+    """prefetch_symbols for every symbol a rules document references"""
+    start = time.time()
+    symbols = rules_symbols(rules)
+    collect = time.time() - start
+    return {'collect': collect, **prefetch_symbols(symbols, workers)}
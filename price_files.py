@@ -0,0 +1,44 @@
+import os
+import numpy as np
+
+# Local columnar price store, one pair of .npy files per symbol:
+#   <symbol>.dates.npy   datetime64[ns], sorted
+#   <symbol>.values.npy  float64 (len(dates), len(PRICE_COLUMNS))
+# plus a VERSION file bumped on every write. The DPU writes them (see
+# DPU/update_prices.write_price_files); the backend memory-maps them.
+
+def _path(directory, symbol, part):
+    return os.path.join(directory, f"{symbol.replace('/', '_')}.{part}.npy")
+
+def has_price_file(directory, symbol):
+    # dates are written last, so a symbol only counts once both files exist
+    return os.path.exists(_path(directory, symbol, 'dates'))
+
+def read_price_file(directory, symbol):
+    """Memory-map a symbol's (dates, values) arrays; nothing is read until it is sliced"""
+    if not has_price_file(directory, symbol):
+        raise FileNotFoundError(f"No price file for {symbol} in {directory}")
+    for _ in range(3):
+        dates = np.load(_path(directory, symbol, 'dates'), mmap_mode='r')
+        values = np.load(_path(directory, symbol, 'values'), mmap_mode='r')
+        # a writer replaces values then dates, so a read in between sees different lengths
+        if len(dates) == len(values):
+            return dates, values
+    raise ValueError(f"Price files for {symbol} in {directory} do not match")
+
+def write_price_file(directory, symbol, dates, values):
+    """Write a symbol's arrays. Each file is replaced atomically, so readers never see a partial one"""
+    os.makedirs(directory, exist_ok=True)
+    for part, array in (('values', np.asarray(values, dtype=np.float64)), ('dates', np.asarray(dates, dtype='datetime64[ns]'))):
+        path = _path(directory, symbol, part)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+
+def read_version(directory):
+    """The files' data version, 0 if nothing has been written"""
+    try:
+        with open(os.path.join(directory, 'VERSION')) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
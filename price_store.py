@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from bounded_lru import BoundedLRU
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+
+class PriceStore:
+    """
+    Holds each symbol's full price history in contiguous NumPy arrays and hands out
+    zero-copy views truncated at an end date.
+
+    loader(symbol) must return (dates, values): a sorted datetime64[ns] array and a
+    float64 array of shape (len(dates), len(PRICE_COLUMNS)). Symbols are evicted least
+    recently used first once the arrays held exceed max_bytes.
+    """
+
+    def __init__(self, loader, max_bytes):
+        self.loader = loader
+        self._entries = BoundedLRU(
+            max_bytes,
+            sizeof=lambda arrays: arrays[0].nbytes + arrays[1].nbytes,
+            keep_last=True,
+            on_evict=lambda symbol, arrays: print(f"Evicted {symbol} from price store"),
+        )
+
+    @property
+    def max_bytes(self):
+        return self._entries.max_bytes
+
+    def arrays(self, symbol):
+        """Return the full (dates, values) arrays for symbol, loading them on first use"""
+        arrays = self._entries.get(symbol)
+        if arrays is not None:
+            return arrays
+        dates, values = self.loader(symbol)
+        return self.put(symbol, dates, values, replace=False)
+
+    def put(self, symbol, dates, values, replace=True):
+        """Store arrays loaded elsewhere, e.g. in bulk, and return them as arrays() would"""
+        dates = np.ascontiguousarray(dates, dtype='datetime64[ns]')
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        # views are shared by every caller, so nobody gets to modify them in place
+        dates.flags.writeable = False
+        values.flags.writeable = False
+        return self._entries.put(symbol, (dates, values), replace=replace)
+
+    def __contains__(self, symbol):
+        return symbol in self._entries
+
+    def view(self, symbol, end_date=None):
+        """Return (dates, values) views of the rows dated on or before end_date"""
+        dates, values = self.arrays(symbol)
+        if end_date is None:
+            return dates, values
+        end = dates.searchsorted(np.datetime64(pd.Timestamp(end_date), 'ns'), side='right')
+        return dates[:end], values[:end]
+
+    def history(self, symbol, end_date=None):
+        """Return the rows dated on or before end_date as a DataFrame backed by the stored arrays"""
+        dates, values = self.view(symbol, end_date)
+        index = pd.DatetimeIndex(dates, name='date')
+        return pd.DataFrame(values, index=index, columns=PRICE_COLUMNS, copy=False)
+
+    def evict(self, symbol):
+        self._entries.pop(symbol)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        stats = self._entries.stats()
+        return {'symbols': stats['entries'], 'bytes': stats['bytes'], 'max_bytes': stats['max_bytes']}
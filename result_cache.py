@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+from datetime import datetime
+from bounded_lru import BoundedLRU
+
+def cache_key(payload, data_version):
+    """
+    Content address of a /backtest or /backtest/batch payload: a hash of the canonical
+    rules JSON (or the batch's strategies), the dates, the capital, the contributions, the
+    schedules, the execution options, the response layout and the price data version. A
+    single backtest's name doesn't change the result, so it isn't part of the key; batch
+    responses include the names, so theirs are.
+    """
+    canonical = json.dumps({
+        'rules': payload.get('rules'),
+        'strategies': payload.get('strategies'),
+        'start_date': datetime.strptime(payload['start_date'], "%Y-%m-%d").date().isoformat(),
+        'end_date': datetime.strptime(payload['end_date'], "%Y-%m-%d").date().isoformat(),
+        'starting_capital': float(payload['starting_capital']),
+        'monthly_investment': float(payload['monthly_investment']),
+        'rebalance': payload.get('rebalance', 'monthly'),
+        'contribution_schedule': payload.get('contribution_schedule', 'monthly'),
+        'execution': payload.get('execution') or {},
+        'layout': payload.get('layout', 'records'),
+        'data_version': data_version,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ResultCache:
+    """
+    Backtest response JSON by cache_key. Entries are evicted least recently used first
+    once the responses held exceed max_bytes, and all of them are dropped when the price
+    data version moves on.
+    """
+
+    def __init__(self, max_bytes):
+        self.data_version = None
+        self._entries = BoundedLRU(max_bytes, sizeof=len)
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._entries.max_bytes
+
+    def set_data_version(self, data_version):
+        """Record the current price data version, clearing the cache if it changed"""
+        with self._lock:
+            if data_version != self.data_version:
+                if len(self._entries):
+                    print(f"Price data version {self.data_version} -> {data_version}, dropping {len(self._entries)} cached results")
+                self._entries.clear()
+                self.data_version = data_version
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, response_json, data_version):
+        with self._lock:
+            # a backtest that started before the prices changed finished after the change
+            if data_version != self.data_version:
+                return
+            self._entries.put(key, response_json)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._entries.stats(), 'data_version': self.data_version}
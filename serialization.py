@@ -0,0 +1,96 @@
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+
+# Set to a path to also write every /backtest response there, for debugging
+RESPONSE_FILE = os.getenv('BACKTEST_RESPONSE_FILE')
+
+# records: [{"date": ..., column: value, ...}, ...]
+# columnar: {"dates": [...], column: [...], ...}
+RESPONSE_LAYOUTS = ('records', 'columnar')
+
+def clean_value(value):
+    """A stat as a JSON-safe value: NaN and inf become None, NumPy scalars plain numbers"""
+    if isinstance(value, (np.floating, float)):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return str(value)
+
+def frame_json(df, layout='records'):
+    """
+    Serialize a date-indexed DataFrame of numbers to JSON in one vectorized pass.
+    NaN and inf become null and dates are formatted YYYY-MM-DD.
+    """
+    dates = df.index.strftime('%Y-%m-%d')
+    if layout == 'columnar':
+        columns = [f'"dates": {json.dumps(list(dates))}']
+        for column in df.columns:
+            values = df[column].to_json(orient='values', double_precision=15)
+            columns.append(f'{json.dumps(str(column))}: {values}')
+        return '{' + ', '.join(columns) + '}'
+
+    records = df.reset_index(drop=True)
+    records['date'] = dates
+    return records.to_json(orient='records', double_precision=15)
+
+def backtest_response(portfolio, layout='records'):
+    """Serialize a finished backtest into the /backtest response JSON"""
+    if layout not in RESPONSE_LAYOUTS:
+        raise ValueError(f"Unknown response layout {layout}, expected one of {RESPONSE_LAYOUTS}")
+
+    # Get all stats including SPY comparison
+    stats = portfolio.get_total_stats()
+
+    spy_df = pd.DataFrame(
+        stats['spy_stats']['spy_values'],
+        index=stats['daily_values'].index
+    )
+    clean_stats = {key: clean_value(value) for key, value in stats['portfolio_stats'].items()}
+
+    # the series are already JSON, so splice them in rather than encoding them again
+    response_json = (
+        f'{{"layout": "{layout}", '
+        f'"daily_values": {frame_json(stats["daily_values"], layout)}, '
+        f'"spy_values": {frame_json(spy_df, layout)}, '
+        f'"stats": {json.dumps(clean_stats)}}}'
+    )
+
+    if RESPONSE_FILE:
+        with open(RESPONSE_FILE, 'w') as f:
+            f.write(response_json)
+
+    return response_json
+
+def batch_response(strategies, totals, benchmark, layout='records'):
+    """
+    Serialize a /backtest/batch run into one response: each strategy's name, id (if it was
+    loaded by id), daily values and stats, and the SPY benchmark once. totals are the
+    strategies' get_total_stats(benchmark=False), benchmark one full get_total_stats
+    """
+    if layout not in RESPONSE_LAYOUTS:
+        raise ValueError(f"Unknown response layout {layout}, expected one of {RESPONSE_LAYOUTS}")
+
+    results = []
+    for strategy, stats in zip(strategies, totals):
+        clean_stats = {key: clean_value(value) for key, value in stats['portfolio_stats'].items()}
+        results.append(
+            f'{{"name": {json.dumps(strategy.get("name"))}, '
+            f'"strategy_id": {json.dumps(strategy.get("strategy_id"))}, '
+            f'"daily_values": {frame_json(stats["daily_values"], layout)}, '
+            f'"stats": {json.dumps(clean_stats)}}}'
+        )
+
+    spy_stats = dict(benchmark['spy_stats'])
+    spy_df = pd.DataFrame(spy_stats.pop('spy_values'), index=benchmark['daily_values'].index)
+    clean_spy_stats = {key: clean_value(value) for key, value in spy_stats.items()}
+    return (
+        f'{{"layout": "{layout}", '
+        f'"strategies": [{", ".join(results)}], '
+        f'"spy_values": {frame_json(spy_df, layout)}, '
+        f'"spy_stats": {json.dumps(clean_spy_stats)}}}'
+    )
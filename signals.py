@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from trading_system import CompositeIndicator, ConditionNode, SelectNode, WeightNode, comparators
+
+NOT_SET = np.iinfo(np.int64).max
+
+class SignalMatrix:
+    """
+    The transactions a compiled strategy produces on every rebalance date, evaluated for
+    all dates at once.
+
+    buy and sell are dates x symbols arrays of the percentages run_trading_system would
+    put in its 'buy' and 'sell' dicts (NaN where the symbol is absent). buy_order and
+    sell_order record when each symbol was first written, so transactions() rebuilds the
+    dicts in the order run_trading_system would have inserted them. That order matters
+    because every buy spends a share of the cash left after the previous one.
+    """
+
+    def __init__(self, dates, symbols, buy, buy_order, sell, sell_order):
+        self.dates = pd.DatetimeIndex(dates)
+        self.symbols = symbols
+        self.buy = buy
+        self.buy_order = buy_order
+        self.sell = sell
+        self.sell_order = sell_order
+        self._positions = {date: i for i, date in enumerate(self.dates)}
+
+    def transactions(self, date):
+        """Return the transactions for a rebalance date in run_trading_system's format"""
+        i = self._positions[pd.Timestamp(date)]
+        return {
+            'buy': self._row(self.buy, self.buy_order, i),
+            'sell': self._row(self.sell, self.sell_order, i),
+        }
+
+    def _row(self, values, order, i):
+        columns = np.flatnonzero(~np.isnan(values[i]))
+        columns = columns[np.argsort(order[i, columns], kind='stable')]
+        return {self.symbols[column]: float(values[i, column]) for column in columns}
+
+    def to_frames(self):
+        """Return the buy and sell allocations as dates x symbols DataFrames"""
+        buy = pd.DataFrame(self.buy, index=self.dates, columns=self.symbols)
+        sell = pd.DataFrame(self.sell, index=self.dates, columns=self.symbols)
+        return buy, sell
+
+def available_mask(plan, symbol, days):
+    """Vectorized trading_system.symbol_available over days, the normalized dates as datetime64"""
+    earliest_date = plan.earliest_dates.get(symbol)
+    if earliest_date is None:
+        return np.zeros(len(days), dtype=bool)
+    return days >= np.datetime64(earliest_date, 'ns')
+
+def condition_mask(node, dates, plan, engine):
+    """Evaluate a condition on every date. False wherever run_trading_system gets None"""
+    if isinstance(node.indicator, CompositeIndicator):
+        inputs = node.indicator.inputs
+    else:
+        inputs = (node.indicator,)
+    thresholds = node.value if isinstance(node.value, tuple) else (node.value,) * len(inputs)
+
+    days = dates.normalize().to_numpy()
+    result = np.ones(len(dates), dtype=bool)
+    for request, threshold in zip(inputs, thresholds):
+        values, valid = engine.values(request.func, request.symbol, request.params, dates)
+        with np.errstate(invalid='ignore'):
+            compared = comparators[node.comparator](values, threshold)
+        result &= available_mask(plan, request.symbol, days) & valid & compared
+    return result
+
+def build_signal_matrix(plan, dates, engine):
+    """
+    Evaluate a CompiledStrategy on every date at once. Each condition becomes a boolean
+    array over dates and each weight node writes its percentages on the dates its path
+    is true.
+    """
+    dates = pd.DatetimeIndex(dates)
+    days = dates.normalize().to_numpy()
+    symbols = sorted(plan.symbols)
+    columns = {symbol: i for i, symbol in enumerate(symbols)}
+    shape = (len(dates), len(symbols))
+
+    buy = np.full(shape, np.nan)
+    sell = np.full(shape, np.nan)
+    buy_order = np.full(shape, NOT_SET, dtype=np.int64)
+    sell_order = np.full(shape, NOT_SET, dtype=np.int64)
+    sequence = 0
+
+    def write(values, order, symbol, active, percentages):
+        nonlocal sequence
+        column = columns[symbol]
+        values[active, column] = percentages[active]
+        first_write = active & (order[:, column] == NOT_SET)
+        order[first_write, column] = sequence
+        sequence += 1
+
+    def visit(node, mask):
+        nonlocal sequence
+        if isinstance(node, ConditionNode):
+            condition = condition_mask(node, dates, plan, engine)
+            for action in node.if_true:
+                visit(action, mask & condition)
+            for action in node.if_false:
+                visit(action, mask & ~condition)
+            return
+
+        if isinstance(node, SelectNode):
+            # rank the whole symbols x dates panel in one argsort
+            values, valid = engine.panel(node.requests, dates)
+            for j, request in enumerate(node.requests):
+                valid[:, j] &= mask & available_mask(plan, request.symbol, days)
+            keys = np.where(valid, -values if node.order == 'top' else values, np.inf)
+            ranking = np.argsort(keys, axis=1, kind='stable')[:, :node.count]
+            selected = np.minimum(valid.sum(axis=1), node.count)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percentage = 100 / selected / 100
+            universe = np.array([columns[request.symbol] for request in node.requests])
+            # buy_equal inserts the selected symbols best first
+            for rank in range(ranking.shape[1]):
+                rows = np.flatnonzero(rank < selected)
+                cols = universe[ranking[rows, rank]]
+                buy[rows, cols] = percentage[rows]
+                first_write = buy_order[rows, cols] == NOT_SET
+                buy_order[rows[first_write], cols[first_write]] = sequence
+                sequence += 1
+            return
+
+        if not isinstance(node, WeightNode):
+            return
+
+        available = [mask & available_mask(plan, asset.symbol, days) for asset in node.assets]
+
+        if node.weight_type == 'weighted_buy':
+            # summed in asset order so the normalised weights match execute_weight_action exactly
+            total_weight = np.zeros(len(dates))
+            for asset, active in zip(node.assets, available):
+                total_weight += np.where(active, asset.weight, 0.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for asset, active in zip(node.assets, available):
+                    write(buy, buy_order, asset.symbol, active, asset.weight / total_weight)
+        elif node.weight_type == 'equal_buy':
+            count = np.sum(available, axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percentage = 100 / count / 100
+            for asset, active in zip(node.assets, available):
+                write(buy, buy_order, asset.symbol, active, percentage)
+        elif node.weight_type == 'all_sell':
+            for asset, active in zip(node.assets, available):
+                write(sell, sell_order, asset.symbol, active, np.ones(len(dates)))
+        elif node.weight_type == 'partial_sell':
+            for asset, active in zip(node.assets, available):
+                write(sell, sell_order, asset.symbol, active, np.full(len(dates), float(asset.percentage)))
+
+    if plan.root is not None:
+        visit(plan.root, np.ones(len(dates), dtype=bool))
+
+    return SignalMatrix(dates, symbols, buy, buy_order, sell, sell_order)
@@ -0,0 +1,283 @@
+import math
+from collections import deque
+import numpy as np
+from indicators import (
+    atr, atr_percent, cumulative_return, current_price, ema, fibonacci_retracement, macd, max_drawdown, rsi,
+    sma_cross, sma_price, sma_return, standard_deviation_price, standard_deviation_return, vix, vix_change,
+)
+
+# Streaming versions of the indicators in indicators.py, for live daily signals. Each one
+# keeps only the state it needs (a few running averages, or the last `period` values) and
+# is fed one bar at a time with update(bar), a mapping of PRICE_COLUMNS to floats. After
+# a bar, value equals the last row of the matching *_series function over the same bars,
+# to within floating-point tolerance. State round-trips through to_dict/from_dict as JSON.
+
+streaming_types = {} # class name: class, for from_dict
+
+class Streaming:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        streaming_types[cls.__name__] = cls
+
+    def to_dict(self):
+        return _encode(self)
+
+    @staticmethod
+    def from_dict(data):
+        return _decode(data)
+
+def _encode(value):
+    if isinstance(value, Streaming):
+        return {'type': type(value).__name__, 'state': {name: _encode(item) for name, item in vars(value).items()}}
+    if isinstance(value, deque):
+        return {'deque': list(value), 'maxlen': value.maxlen}
+    return value
+
+def _decode(value):
+    if isinstance(value, dict) and 'type' in value:
+        obj = streaming_types[value['type']].__new__(streaming_types[value['type']])
+        obj.__dict__.update({name: _decode(item) for name, item in value['state'].items()})
+        return obj
+    if isinstance(value, dict) and 'deque' in value:
+        return deque(value['deque'], maxlen=value['maxlen'])
+    return value
+
+class Average(Streaming):
+    """
+    Exponential average, like pandas ewm(alpha=alpha, adjust=False). With presma the first
+    length values only seed it with their mean, as pandas_ta's ema and atr do.
+    """
+
+    def __init__(self, length, alpha, presma=True):
+        self.length = length
+        self.alpha = alpha
+        self.presma = presma
+        self.count = 0
+        self.total = 0.0
+        self.value = math.nan
+
+    def push(self, x):
+        self.count += 1
+        if self.presma and self.count <= self.length:
+            self.total += x
+            if self.count == self.length:
+                self.value = self.total / self.length
+        elif math.isnan(self.value):
+            self.value = x
+        else:
+            self.value = (1 - self.alpha) * self.value + self.alpha * x
+        return self.value
+
+class Window(Streaming):
+    """The last length values"""
+
+    def __init__(self, length):
+        self.values = deque(maxlen=length)
+
+    def push(self, x):
+        self.values.append(x)
+
+    @property
+    def full(self):
+        return len(self.values) == self.values.maxlen
+
+class Price(Streaming):
+    """current_price, and vix without a period"""
+
+    def __init__(self):
+        self.value = math.nan
+
+    def update(self, bar):
+        self.value = bar['close']
+        return self.value
+
+class EMA(Streaming):
+    def __init__(self, period):
+        self.average = Average(period, 2 / (period + 1))
+        self.value = math.nan
+
+    def update(self, bar):
+        self.value = self.average.push(bar['close'])
+        return self.value
+
+class MACD(Streaming):
+    """The MACD line, fast EMA minus slow EMA; the signal period doesn't change it"""
+
+    def __init__(self, fast_period, slow_period, signal_period):
+        self.fast = EMA(fast_period)
+        self.slow = EMA(slow_period)
+        self.value = math.nan
+
+    def update(self, bar):
+        self.value = self.fast.update(bar) - self.slow.update(bar)
+        return self.value
+
+class RSI(Streaming):
+    """Wilder's RSI: running averages of the gains and losses, started from the first change"""
+
+    def __init__(self, period):
+        self.previous = None
+        self.gains = Average(period, 1 / period, presma=False)
+        self.losses = Average(period, 1 / period, presma=False)
+        self.value = math.nan
+
+    def update(self, bar):
+        close = bar['close']
+        if self.previous is not None:
+            change = close - self.previous
+            gain = self.gains.push(max(change, 0.0))
+            loss = abs(self.losses.push(min(change, 0.0)))
+            self.value = 100 * gain / (gain + loss) if gain + loss else math.nan
+        self.previous = close
+        return self.value
+
+class ATR(Streaming):
+    """Average true range, seeded with the mean of the first period ranges. percent divides it by the close"""
+
+    def __init__(self, period, percent=False):
+        self.previous = None
+        self.average = Average(period, 1 / period)
+        self.percent = percent
+        self.value = math.nan
+
+    def update(self, bar):
+        high, low, close = bar['high'], bar['low'], bar['close']
+        true_range = abs(high - low)
+        if self.previous is not None:
+            true_range = max(true_range, abs(high - self.previous), abs(self.previous - low))
+        self.previous = close
+        value = self.average.push(true_range)
+        self.value = value / close if self.percent else value
+        return self.value
+
+class SMA(Streaming):
+    def __init__(self, period):
+        self.window = Window(period)
+        self.value = math.nan
+
+    def update(self, bar):
+        self.window.push(bar['close'])
+        if self.window.full:
+            self.value = math.fsum(self.window.values) / len(self.window.values)
+        return self.value
+
+class SMACross(Streaming):
+    """Fast SMA over slow SMA"""
+
+    def __init__(self, fast_period, slow_period):
+        self.fast = SMA(fast_period)
+        self.slow = SMA(slow_period)
+        self.value = math.nan
+
+    def update(self, bar):
+        self.value = self.fast.update(bar) / self.slow.update(bar)
+        return self.value
+
+class Change(Streaming):
+    """Change of the close over the last period bars, relative to the first (cumulative_return) or in points (vix_change)"""
+
+    def __init__(self, period, relative=True):
+        self.window = Window(period)
+        self.relative = relative
+        self.value = math.nan
+
+    def update(self, bar):
+        self.window.push(bar['close'])
+        if self.window.full:
+            first, last = self.window.values[0], self.window.values[-1]
+            self.value = (last - first) / first if self.relative else last - first
+        return self.value
+
+class Fibonacci(Streaming):
+    """Where the close sits between the highest high and lowest low of the last period bars"""
+
+    def __init__(self, period):
+        self.highs = Window(period)
+        self.lows = Window(period)
+        self.value = math.nan
+
+    def update(self, bar):
+        self.highs.push(bar['high'])
+        self.lows.push(bar['low'])
+        if self.highs.full:
+            high, low = max(self.highs.values), min(self.lows.values)
+            self.value = (high - bar['close']) / (high - low) if high != low else math.nan
+        return self.value
+
+class Drawdown(Streaming):
+    """
+    max_drawdown: without a period, the close's drawdown from its running max; with one, the
+    lowest drawdown from the rolling max seen so far
+    """
+
+    def __init__(self, period=None):
+        self.window = Window(period) if period else None
+        self.peak = -math.inf
+        self.lowest = math.inf
+        self.value = math.nan
+
+    def update(self, bar):
+        close = bar['close']
+        if self.window is None:
+            self.peak = max(self.peak, close)
+            self.value = (close - self.peak) / self.peak
+            return self.value
+        self.window.push(close)
+        if self.window.full:
+            peak = max(self.window.values)
+            self.lowest = min(self.lowest, (close - peak) / peak)
+            self.value = self.lowest
+        return self.value
+
+class Deviation(Streaming):
+    """Sample standard deviation of the last period closes"""
+
+    def __init__(self, period):
+        self.window = Window(period)
+        self.value = math.nan
+
+    def update(self, bar):
+        self.window.push(bar['close'])
+        if self.window.full:
+            self.value = float(np.std(self.window.values, ddof=1))
+        return self.value
+
+class ReturnStat(Streaming):
+    """Mean or sample standard deviation of the last period daily returns"""
+
+    def __init__(self, period, stat='mean'):
+        self.previous = None
+        self.window = Window(period)
+        self.stat = stat
+        self.value = math.nan
+
+    def update(self, bar):
+        close = bar['close']
+        if self.previous is not None:
+            self.window.push((close - self.previous) / self.previous)
+            if self.window.full:
+                values = self.window.values
+                self.value = math.fsum(values) / len(values) if self.stat == 'mean' else float(np.std(values, ddof=1))
+        self.previous = close
+        return self.value
+
+# indicator -> factory taking the indicator's params. Indicators missing here (adx and the
+# stochastic oscillator) have no streaming version.
+streaming_map = {
+    rsi: RSI,
+    ema: EMA,
+    macd: MACD,
+    sma_price: SMA,
+    fibonacci_retracement: Fibonacci,
+    standard_deviation_price: Deviation,
+    sma_return: lambda period: ReturnStat(period, 'mean'),
+    standard_deviation_return: lambda period: ReturnStat(period, 'std'),
+    max_drawdown: Drawdown,
+    current_price: Price,
+    cumulative_return: Change,
+    atr: ATR,
+    atr_percent: lambda period: ATR(period, percent=True),
+    vix: lambda period=None: SMA(period) if period else Price(),
+    vix_change: lambda period: Change(period, relative=False),
+    sma_cross: SMACross,
+}
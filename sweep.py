@@ -0,0 +1,205 @@
+import argparse
+import contextlib
+import copy
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from termcolor import colored
+import data_fetcher
+from price_store import PRICE_COLUMNS
+from backtesting import Portfolio
+from benchmark import dca_values
+from indicator_engine import indicator_cache
+from prefetch import prefetch_symbols, rules_symbols
+from indicators import series_map
+from trading_system import compile_rules, load_rules
+
+# stats where lower is better, so run_sweep ranks them lowest first; every other stat ranks highest first
+LOWER_IS_BETTER = {'Volatility', 'Beta'}
+
+def parse_values(spec):
+    """
+    Parse a parameter range: 'start:stop:step' (stop inclusive) or a comma separated list.
+    Values are JSON, so '0.05' is a float and '26' an int.
+    """
+    if spec.count(':') == 2:
+        start, stop, step = (json.loads(part) for part in spec.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        values = [start + i * step for i in range(count)]
+        if all(isinstance(value, int) for value in (start, stop, step)):
+            return values
+        # avoid 0.060000000000000005 style thresholds
+        return [round(value, 10) for value in values]
+    return [json.loads(part) for part in spec.split(',')]
+
+def set_path(rules, path, value):
+    """Set a value in a rules document by dotted path, e.g. 'rules.if_true.0.value'"""
+    keys = path.split('.')
+    node = rules
+    for key in keys[:-1]:
+        node = node[int(key)] if isinstance(node, list) else node[key]
+    last = keys[-1]
+    if isinstance(node, list):
+        node[int(last)] = value
+    else:
+        if last not in node:
+            raise ValueError(f"Path {path} does not exist in the rules template")
+        node[last] = value
+
+def expand_variants(template, ranges):
+    """Expand a rules template and {path: [values]} into a list of (params, rules) variants"""
+    paths = list(ranges)
+    variants = []
+    for values in itertools.product(*(ranges[path] for path in paths)):
+        params = dict(zip(paths, values))
+        rules = copy.deepcopy(template)
+        for path, value in params.items():
+            set_path(rules, path, value)
+        rules['name'] = f"{template['name']} {json.dumps(params)}"
+        variants.append((params, rules))
+    return variants
+
+def data_symbols(plans):
+    """Every symbol whose prices a set of compiled strategies needs, including the SPY benchmark"""
+    symbols = {'SPY'}
+    for plan in plans:
+        symbols |= plan.symbols
+        for request in plan.requests:
+            data_symbol = series_map[request.func][2]
+            symbols.add(data_symbol or request.symbol)
+    return sorted(symbols)
+
+def share_price_data(symbols):
+    """
+    Copy the price store arrays of symbols into one shared memory block.
+    Returns the block and a layout {symbol: (offset, rows)} that workers use to attach.
+    """
+    arrays = {symbol: data_fetcher.price_store.arrays(symbol) for symbol in symbols}
+    row_bytes = 8 + 8 * len(PRICE_COLUMNS) # int64 date + float64 values
+    total = sum(len(dates) for dates, _ in arrays.values()) * row_bytes
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+
+    layout = {}
+    offset = 0
+    for symbol, (dates, values) in arrays.items():
+        rows = len(dates)
+        shared_dates, shared_values = _views(block.buf, offset, rows)
+        shared_dates[:] = dates.view(np.int64)
+        shared_values[:] = values
+        layout[symbol] = (offset, rows)
+        offset += rows * row_bytes
+    return block, layout
+
+def _views(buffer, offset, rows):
+    dates = np.ndarray((rows,), dtype=np.int64, buffer=buffer, offset=offset)
+    values = np.ndarray((rows, len(PRICE_COLUMNS)), dtype=np.float64, buffer=buffer, offset=offset + rows * 8)
+    return dates, values
+
+_shared_block = None
+
+def _attach_price_data(block_name, layout):
+    """Worker initializer: serve the price store from the shared block instead of the database"""
+    global _shared_block
+    _shared_block = shared_memory.SharedMemory(name=block_name)
+
+    def load_shared(symbol):
+        if symbol not in layout:
+            raise ValueError(f"Symbol {symbol} was not shared with the sweep workers")
+        dates, values = _views(_shared_block.buf, *layout[symbol])
+        return dates.view('datetime64[ns]'), values
+
+    data_fetcher.price_store.loader = load_shared
+    data_fetcher.price_store.clear()
+    indicator_cache.clear()
+    data_fetcher.get_earliest_date.cache_clear()
+    data_fetcher.get_trading_calendar.cache_clear()
+    dca_values.cache_clear()
+
+def run_variant(params, rules, start_date, end_date, starting_capital, monthly_investment):
+    """Backtest one variant and return its params with Portfolio.stats()"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        portfolio = Portfolio(starting_capital, monthly_investment, rules, end_date, start_date, vectorized=True)
+        portfolio.backtest()
+        stats = portfolio.stats().iloc[0].to_dict()
+    return {**params, **stats}
+
+def run_sweep(template, ranges, start_date, end_date, starting_capital, monthly_investment, workers=None, rank_by='Sharpe Ratio', ascending=None):
+    """
+    Backtest every combination of ranges on template across a process pool and return a
+    table of stats per variant, best rank_by first. ascending overrides the direction
+    LOWER_IS_BETTER gives rank_by.
+    """
+    workers = workers or os.cpu_count()
+    variants = expand_variants(template, ranges)
+    print(colored(f"Running {len(variants)} variants on {workers} workers", 'blue'))
+
+    prefetch_symbols(sorted(set().union(*(rules_symbols(rules) for _, rules in variants))))
+
+    start = time.time()
+    plans = [compile_rules(rules) for _, rules in variants]
+    block, layout = share_price_data(data_symbols(plans))
+    print(f"Shared {len(layout)} symbols ({block.size / 1e6:.1f} MB) in {time.time() - start:.2f}s")
+
+    try:
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_price_data, initargs=(block.name, layout)) as executor:
+            futures = [
+                executor.submit(run_variant, params, rules, start_date, end_date, starting_capital, monthly_investment)
+                for params, rules in variants
+            ]
+            results = [future.result() for future in futures]
+        elapsed = time.time() - start
+    finally:
+        block.close()
+        block.unlink()
+
+    print(f"Ran {len(variants)} variants in {elapsed:.2f}s: {len(variants) / elapsed / workers:.2f} variants/s per core")
+
+    table = pd.DataFrame(results)
+    if ascending is None:
+        ascending = rank_by in LOWER_IS_BETTER
+    return table.sort_values(rank_by, ascending=ascending).reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest every combination of parameters in a rules template")
+    parser.add_argument('rules', help="rules template, e.g. rules.json")
+    parser.add_argument('--param', action='append', required=True, metavar='PATH=VALUES',
+                        help="dotted path into the rules and its values, e.g. rules.if_true.0.value=0.03:0.08:0.01 or rules.indicator.params.0=12,26")
+    parser.add_argument('--start', default='2012-01-01')
+    parser.add_argument('--end', default=datetime.now().strftime('%Y-%m-%d'))
+    parser.add_argument('--capital', type=float, default=1000)
+    parser.add_argument('--monthly', type=float, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank-by', default='Sharpe Ratio')
+    parser.add_argument('--ascending', action=argparse.BooleanOptionalAction, default=None,
+                        help="rank lowest first; by default only stats where lower is better, like Volatility and Beta, are")
+    args = parser.parse_args()
+
+    ranges = {}
+    for param in args.param:
+        path, spec = param.split('=', 1)
+        ranges[path] = parse_values(spec)
+
+    table = run_sweep(
+        load_rules(args.rules),
+        ranges,
+        datetime.strptime(args.start, "%Y-%m-%d"),
+        datetime.strptime(args.end, "%Y-%m-%d"),
+        args.capital,
+        args.monthly,
+        workers=args.workers,
+        rank_by=args.rank_by,
+        ascending=args.ascending,
+    )
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(table)
+
+if __name__ == "__main__":
+    main()
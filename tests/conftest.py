@@ -0,0 +1,44 @@
+import zlib
+import numpy as np
+import pandas as pd
+import pytest
+import data_fetcher
+import trading_system
+from benchmark import dca_values
+from indicator_engine import indicator_cache
+from price_store import PRICE_COLUMNS
+
+def synthetic_arrays(symbol, start, end):
+    """A random walk of business-day bars for symbol from start, the same on every call, with adjusted closes 10% below the closes"""
+    dates = pd.bdate_range(start, end).values
+    # one row of draws per bar, so a longer history extends a shorter one
+    draws = np.random.default_rng(zlib.crc32(symbol.encode())).normal(size=(len(dates), 2))
+    close = 50 * np.exp(np.cumsum(0.0003 + 0.015 * draws[:, 0]))
+    open_ = close * np.exp(0.005 * draws[:, 1])
+    values = np.empty((len(dates), len(PRICE_COLUMNS)))
+    values[:, PRICE_COLUMNS.index('open')] = open_
+    values[:, PRICE_COLUMNS.index('high')] = np.maximum(open_, close) * 1.01
+    values[:, PRICE_COLUMNS.index('low')] = np.minimum(open_, close) * 0.99
+    values[:, PRICE_COLUMNS.index('close')] = close
+    values[:, PRICE_COLUMNS.index('adj_close')] = close * 0.9
+    values[:, PRICE_COLUMNS.index('volume')] = 1e6
+    return dates, values
+
+@pytest.fixture
+def synthetic_prices(monkeypatch):
+    """Serve every symbol from synthetic_arrays instead of the database. Call it with the first and last bar date"""
+    def install(start='2015-01-01', end='2024-03-01'):
+        monkeypatch.setattr(data_fetcher.price_store, 'loader', lambda symbol: synthetic_arrays(symbol, start, end))
+        data_fetcher.price_store.clear()
+        data_fetcher.get_trading_calendar.cache_clear()
+        data_fetcher.get_earliest_date.cache_clear()
+        trading_system._compile_rules_json.cache_clear()
+        indicator_cache.clear()
+        dca_values.cache_clear()
+
+    yield install
+    data_fetcher.price_store.clear()
+    data_fetcher.get_trading_calendar.cache_clear()
+    data_fetcher.get_earliest_date.cache_clear()
+    indicator_cache.clear()
+    dca_values.cache_clear()
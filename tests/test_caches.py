@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from bounded_lru import BoundedLRU
+from indicator_cache import IndicatorCache
+from price_store import PriceStore
+from result_cache import ResultCache
+from conftest import synthetic_arrays
+
+def test_bounded_lru_evicts_least_recently_used_first():
+    entries = BoundedLRU(10, sizeof=len)
+    entries.put('a', 'xxxx')
+    entries.put('b', 'xxxx')
+    entries.get('a')
+    entries.put('c', 'xxxx')
+
+    assert 'a' in entries and 'c' in entries and 'b' not in entries
+    assert entries.stats()['bytes'] == 8
+    assert entries.stats()['evictions'] == 1
+
+def test_keep_last_only_decides_whether_an_oversized_entry_stays():
+    results = ResultCache(max_bytes=5)
+    results.set_data_version(1)
+    results.put('key', 'x' * 10, 1)
+    assert results.get('key') is None
+
+    price_store = PriceStore(lambda symbol: synthetic_arrays(symbol, '2020-01-01', '2024-01-01'), max_bytes=1)
+    price_store.arrays('SPY')
+    price_store.arrays('QQQ')
+    assert price_store.stats()['symbols'] == 1 and 'QQQ' in price_store
+
+def test_indicator_cache_owns_and_counts_its_dates():
+    dates, values = synthetic_arrays('SPY', '2020-01-01', '2024-01-01')
+    index = pd.DatetimeIndex(dates)
+    cache = IndicatorCache(max_bytes=1 << 20)
+    cached_dates, cached_values = cache.put(('sma', 'SPY', (20,)), index, values[:, 4].copy())
+
+    assert not np.shares_memory(cached_dates.values, dates)
+    assert cached_dates.equals(index)
+    assert cache.stats()['bytes'] == index.nbytes + cached_values.nbytes
+    cache.evict_symbol('SPY')
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
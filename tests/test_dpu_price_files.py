@@ -0,0 +1,93 @@
+import contextlib
+import importlib
+import os
+import sys
+import numpy as np
+import pandas as pd
+import psycopg2.pool
+import pytest
+import price_files
+from conftest import synthetic_arrays
+from price_store import PRICE_COLUMNS
+
+YAHOO_COLUMNS = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'adj_close': 'Adj Close', 'volume': 'Volume'}
+
+class PricesCursor:
+    """Serves update_prices.price_history from an in-memory prices table of (symbol, date, *PRICE_COLUMNS) rows"""
+
+    def __init__(self, prices):
+        self.prices = prices
+        self._rows = []
+
+    def execute(self, sql, args=None):
+        if 'FROM prices' in sql:
+            tickers = set(args[0])
+            self._rows = sorted(row for row in self.prices if row[0] in tickers)
+
+    def fetchall(self):
+        return self._rows
+
+@pytest.fixture
+def update_prices(monkeypatch, tmp_path):
+    """DPU/update_prices.py with an in-memory database and its price files in tmp_path"""
+    monkeypatch.setattr(psycopg2.pool, 'SimpleConnectionPool', lambda **kwargs: None)
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), '..', 'DPU'))
+    sys.modules.pop('update_prices', None)
+    module = importlib.import_module('update_prices')
+
+    prices, marks = [], {}
+    @contextlib.contextmanager
+    def connection():
+        class Connection:
+            def cursor(self):
+                return contextlib.nullcontext(PricesCursor(prices))
+            def commit(self):
+                pass
+        yield Connection()
+
+    def copy_prices(cur, frame):
+        rows = list(frame[['symbol', 'date'] + PRICE_COLUMNS].itertuples(index=False, name=None))
+        prices.extend((symbol, pd.Timestamp(date).date(), *values) for symbol, date, *values in rows)
+        return len(rows)
+
+    monkeypatch.setattr(module, 'PRICE_FILES_DIR', str(tmp_path / 'price_files'))
+    monkeypatch.setattr(module, 'get_db_connection', connection)
+    monkeypatch.setattr(module, 'get_all_tickers', lambda: ['SPY', 'TLT'])
+    monkeypatch.setattr(module, 'copy_prices', copy_prices)
+    monkeypatch.setattr(module, 'create_high_water_marks', lambda cur: None)
+    monkeypatch.setattr(module, 'get_high_water_marks', lambda cur, tickers: {t: marks[t] for t in tickers if t in marks})
+    monkeypatch.setattr(module, 'set_high_water_marks', lambda cur, new_marks: marks.update(new_marks))
+    yield module
+    sys.modules.pop('update_prices', None)
+
+def write_csvs(directory, end):
+    for symbol in ['SPY', 'TLT']:
+        dates, values = synthetic_arrays(symbol, '2023-01-02', end)
+        frame = pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='Date'), columns=PRICE_COLUMNS)
+        frame.rename(columns=YAHOO_COLUMNS).to_csv(directory / f'{symbol}.csv')
+
+def test_incremental_update_writes_the_whole_history_to_new_price_files(update_prices, tmp_path):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    # the database was filled before PRICE_FILES_DIR was set
+    write_csvs(csv_dir, '2024-02-28')
+    price_files_dir = update_prices.PRICE_FILES_DIR
+    update_prices.PRICE_FILES_DIR = None
+    update_prices.update_all_prices(fetcher=update_prices.csv_fetcher(str(csv_dir)))
+    update_prices.PRICE_FILES_DIR = price_files_dir
+
+    # two new bars arrive and the first incremental update creates the files
+    write_csvs(csv_dir, '2024-03-01')
+    update_prices.update_incremental(update_prices.csv_fetcher(str(csv_dir)))
+
+    for symbol in ['SPY', 'TLT']:
+        expected_dates, expected_values = synthetic_arrays(symbol, '2023-01-02', '2024-03-01')
+        dates, values = price_files.read_price_file(price_files_dir, symbol)
+        assert np.array_equal(dates, expected_dates)
+        np.testing.assert_allclose(values, expected_values, rtol=1e-12)
+
+    # and the next one merges into them
+    write_csvs(csv_dir, '2024-03-05')
+    update_prices.update_incremental(update_prices.csv_fetcher(str(csv_dir)))
+    dates, _ = price_files.read_price_file(price_files_dir, 'SPY')
+    assert np.array_equal(dates, synthetic_arrays('SPY', '2023-01-02', '2024-03-05')[0])
@@ -0,0 +1,31 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from backtesting import Portfolio
+from execution import FillPrices
+from price_store import PRICE_COLUMNS
+from trading_system import load_rules
+from conftest import synthetic_arrays
+
+@pytest.mark.parametrize('policy', ['close', 'next_open', 'nearest'])
+def test_backtest_up_to_the_last_bar(synthetic_prices, policy):
+    synthetic_prices(end='2024-03-01')
+    portfolio = Portfolio(1000, 100, load_rules('rules.json'), datetime(2024, 3, 1), datetime(2023, 1, 2), vectorized=True, execution=policy)
+    portfolio.backtest()
+
+    values = list(portfolio.portfolio_value_history.values())
+    assert list(portfolio.portfolio_value_history)[-1].isoformat() == '2024-03-01'
+    assert np.isfinite(values).all()
+    # the 2024-03-01 rebalance only has a next open once another bar arrives
+    assert portfolio.fills.fillable(datetime(2024, 3, 1)) == (policy != 'next_open')
+
+def test_next_open_fills_at_the_adjusted_open_of_the_next_bar(synthetic_prices):
+    synthetic_prices(end='2024-03-01')
+    dates, values = synthetic_arrays('SPY', '2015-01-01', '2024-03-01')
+    fills = FillPrices(['SPY'], [datetime(2024, 2, 27)], 'next_open')
+
+    row = np.searchsorted(dates, np.datetime64('2024-02-28'))
+    expected = values[row, PRICE_COLUMNS.index('open')] * 0.9
+    assert fills.prices(datetime(2024, 2, 27), ['SPY'])[0] == pytest.approx(expected)
+    assert fills.fillable(datetime(2024, 2, 29))
+    assert not fills.fillable(datetime(2024, 3, 1))
@@ -0,0 +1,10 @@
+import contextlib
+import io
+from datetime import datetime
+from backtesting import check_precision
+from trading_system import load_rules
+
+def test_float64_matches_decimal(synthetic_prices):
+    synthetic_prices(end='2024-03-01')
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert check_precision(1000, 100, load_rules('rules.json'), datetime(2024, 3, 1), datetime(2020, 1, 1), tolerance=1e-9)
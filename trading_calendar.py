@@ -0,0 +1,115 @@
+from datetime import date as Date, datetime
+import numpy as np
+import pandas as pd
+
+# pandas period codes for the schedules first_sessions and last_sessions understand
+PERIODS = {
+    'week': 'W',
+    'month': 'M',
+    'quarter': 'Q',
+}
+
+# rebalance and contribution schedules, besides an explicit list of dates
+SCHEDULES = {
+    'daily': None,
+    'weekly': 'week',
+    'monthly': 'month',
+    'quarterly': 'quarter',
+}
+
+def check_schedule(schedule):
+    """Raise ValueError unless schedule is one of SCHEDULES or a list of dates"""
+    if isinstance(schedule, str):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule {schedule}, expected one of {list(SCHEDULES)} or a list of dates")
+        return
+    if not isinstance(schedule, (list, tuple)):
+        raise ValueError(f"A schedule must be one of {list(SCHEDULES)} or a list of dates")
+    for date in schedule:
+        _day(date)
+
+def _day(date):
+    """date, datetime, pd.Timestamp or np.datetime64 as a datetime.date"""
+    if isinstance(date, datetime):
+        return date.date()
+    if isinstance(date, Date):
+        return date
+    return pd.Timestamp(date).date()
+
+class TradingCalendar:
+    """
+    The trading sessions, in order, with O(1) membership and the first and last session
+    of every week, month and quarter precomputed.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = pd.DatetimeIndex(sessions).normalize().unique().sort_values()
+        self.days = self.sessions.date # datetime.date per session
+        self._positions = {day: i for i, day in enumerate(self.days)}
+        self._periods = {} # period: (first session positions, last session positions)
+        for period, code in PERIODS.items():
+            keys = self.sessions.to_period(code).asi8
+            starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1) != 0)
+            ends = np.append(starts[1:] - 1, len(keys) - 1) if len(keys) else starts
+            self._periods[period] = (starts, ends)
+        self._first = {period: set(self.days[starts]) for period, (starts, _) in self._periods.items()}
+        self._last = {period: set(self.days[ends]) for period, (_, ends) in self._periods.items()}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, date):
+        return _day(date) in self._positions
+
+    def is_session(self, date):
+        return _day(date) in self._positions
+
+    def next_session(self, date):
+        """The first session after date, or None"""
+        i = self.days.searchsorted(_day(date), side='right')
+        return self.days[i] if i < len(self.days) else None
+
+    def previous_session(self, date):
+        """The last session before date, or None"""
+        i = self.days.searchsorted(_day(date), side='left')
+        return self.days[i - 1] if i > 0 else None
+
+    def sessions_between(self, start, end):
+        """The sessions from start to end inclusive, as datetime.dates"""
+        lo = self.days.searchsorted(_day(start), side='left')
+        hi = self.days.searchsorted(_day(end), side='right')
+        return list(self.days[lo:hi])
+
+    def first_sessions(self, period):
+        """The first session of every week, month or quarter"""
+        starts, _ = self._periods[period]
+        return list(self.days[starts])
+
+    def last_sessions(self, period):
+        """The last session of every week, month or quarter"""
+        _, ends = self._periods[period]
+        return list(self.days[ends])
+
+    def schedule_sessions(self, schedule):
+        """
+        The sessions a schedule falls on: every session for 'daily', the first session of every
+        week, month or quarter, or for a list of dates the first session on or after each one
+        """
+        check_schedule(schedule)
+        if isinstance(schedule, str):
+            period = SCHEDULES[schedule]
+            return list(self.days) if period is None else self.first_sessions(period)
+
+        sessions = set()
+        for date in schedule:
+            day = _day(date)
+            session = day if day in self._positions else self.next_session(day)
+            if session is not None:
+                sessions.add(session)
+        return sorted(sessions)
+
+    def is_first_session(self, date, period='month'):
+        return _day(date) in self._first[period]
+
+    def is_last_session(self, date, period='month'):
+        return _day(date) in self._last[period]
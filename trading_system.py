@@ -1,4 +1,8 @@
 import json
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
 from indicators import *
 from data_fetcher import get_earliest_date
 from transaction_types import *
@@ -19,59 +23,225 @@ indicator_map = {
     'sma_cross': sma_cross,
 }
 
-def evaluate_indicator(indicator_data, end_date):
-    """Evaluate an indicator and return its value"""
+comparators = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+weight_types = ('equal_buy', 'weighted_buy', 'all_sell', 'partial_sell')
+
+select_orders = ('top', 'bottom')
+
+@dataclass(frozen=True)
+class IndicatorRequest:
+    """An indicator resolved to its function, evaluated for one symbol with fixed params"""
+    name: str
+    func: object
+    symbol: str
+    params: tuple
+
+@dataclass(frozen=True)
+class CompositeIndicator:
+    """The 'and' indicator: every input is compared against the condition's threshold(s)"""
+    inputs: tuple
+
+@dataclass(frozen=True)
+class Asset:
+    symbol: str
+    weight: float = None
+    percentage: float = None
+
+@dataclass(frozen=True)
+class ConditionNode:
+    indicator: object # IndicatorRequest or CompositeIndicator
+    comparator: str
+    value: object # number, or tuple of numbers for composite indicators
+    if_true: tuple
+    if_false: tuple
+
+@dataclass(frozen=True)
+class WeightNode:
+    weight_type: str
+    assets: tuple
+
+@dataclass(frozen=True)
+class SelectNode:
+    """Rank a universe by an indicator and buy the top or bottom count symbols with equal weights"""
+    requests: tuple # one IndicatorRequest per universe symbol, in universe order
+    order: str
+    count: int
+
+@dataclass(frozen=True, eq=False)
+class CompiledStrategy:
+    """
+    A rules document compiled once into an immutable evaluation plan.
+    requests holds every distinct IndicatorRequest in the tree, earliest_dates the first
+    date with data for each referenced symbol.
+    """
+    name: str
+    root: object
+    requests: frozenset
+    symbols: frozenset
+    earliest_dates: MappingProxyType
+
+def compile_rules(rules):
+    """Compile a rules document (see rules.json). Identical documents share the same plan"""
+    rules_json = json.dumps({'name': rules.get('name'), 'rules': rules['rules']}, sort_keys=True)
+    return _compile_rules_json(rules_json)
+
+@lru_cache(maxsize=128)
+def _compile_rules_json(rules_json):
+    rules = json.loads(rules_json)
+    requests = set()
+    symbols = set()
+    root = compile_node(rules['rules'], requests, symbols)
+
+    earliest_dates = {symbol: get_earliest_date(symbol) for symbol in sorted(symbols)}
+
+    print(colored(f"Compiled strategy: {rules['name']} ({len(requests)} indicators, {len(symbols)} symbols)", 'green'))
+    return CompiledStrategy(rules['name'], root, frozenset(requests), frozenset(symbols), MappingProxyType(earliest_dates))
+
+def compile_indicator(indicator_data, requests, symbols):
     name = indicator_data['name']
-    params = indicator_data['params']
-    
-    # Special handling for composite indicators
+    params = tuple(indicator_data.get('params', []))
+
     if name == 'and':
         if 'inputs' not in indicator_data:
             raise ValueError("'and' indicator requires 'inputs' field")
-        
+        return CompositeIndicator(tuple(compile_indicator(input_indicator, requests, symbols) for input_indicator in indicator_data['inputs']))
+
+    if 'symbol' not in indicator_data:
+        raise ValueError(f"Indicator {name} missing required 'symbol' field")
+    if name not in indicator_map:
+        raise ValueError(f"Indicator {name} not found")
+
+    request = IndicatorRequest(name, indicator_map[name], indicator_data['symbol'], params)
+    requests.add(request)
+    symbols.add(request.symbol)
+    return request
+
+def compile_node(node, requests, symbols):
+    """Compile a node of the decision tree. Non-dict nodes are ignored, as before"""
+    if not isinstance(node, dict):
+        return None
+
+    node_type = node.get('type')
+
+    if node_type == 'condition':
+        indicator = compile_indicator(node['indicator'], requests, symbols)
+        comparator = node['comparator']
+        if comparator not in comparators:
+            raise ValueError(f"Unknown comparator: {comparator}")
+
+        value = node['value']
+        if isinstance(value, list):
+            if not isinstance(indicator, CompositeIndicator) or len(value) != len(indicator.inputs):
+                raise ValueError("Mismatched number of values for composite indicator comparison")
+            value = tuple(value)
+
+        return ConditionNode(
+            indicator,
+            comparator,
+            value,
+            compile_branch(node['if_true'], requests, symbols),
+            compile_branch(node['if_false'], requests, symbols),
+        )
+
+    elif node_type == 'weight':
+        weight_type = node['weight_type']
+        if weight_type not in weight_types:
+            raise ValueError(f"Unknown weight type: {weight_type}")
+
+        assets = []
+        for asset in node['assets']:
+            if weight_type == 'weighted_buy' and 'weight' not in asset:
+                raise ValueError(f"Asset {asset['symbol']} missing required 'weight' field")
+            if weight_type == 'partial_sell' and 'percentage' not in asset:
+                raise ValueError(f"Asset {asset['symbol']} missing required 'percentage' field")
+            assets.append(Asset(asset['symbol'], asset.get('weight'), asset.get('percentage')))
+            symbols.add(asset['symbol'])
+
+        return WeightNode(weight_type, tuple(assets))
+
+    elif node_type == 'select':
+        indicator_data = node['indicator']
+        name = indicator_data['name']
+        if name not in indicator_map:
+            raise ValueError(f"Indicator {name} not found")
+        order = node.get('order', 'top')
+        if order not in select_orders:
+            raise ValueError(f"Unknown select order: {order}")
+        count = int(node['count'])
+        if count < 1:
+            raise ValueError("select count must be at least 1")
+        if not node.get('universe'):
+            raise ValueError("select node requires a non-empty 'universe'")
+
+        params = tuple(indicator_data.get('params', []))
+        select_requests = []
+        for symbol in dict.fromkeys(node['universe']):
+            request = IndicatorRequest(name, indicator_map[name], symbol, params)
+            requests.add(request)
+            symbols.add(symbol)
+            select_requests.append(request)
+
+        return SelectNode(tuple(select_requests), order, count)
+    else:
+        raise ValueError(f"Unknown node type: {node_type}")
+
+def compile_branch(actions, requests, symbols):
+    if not actions:
+        return ()
+    compiled = (compile_node(action, requests, symbols) for action in actions)
+    return tuple(node for node in compiled if node is not None)
+
+def symbol_available(plan, symbol, end_date):
+    """Check whether symbol has data on or before end_date"""
+    earliest_date = plan.earliest_dates.get(symbol)
+    return earliest_date is not None and earliest_date <= end_date.date()
+
+def evaluate_indicator(indicator, end_date, plan, engine=None):
+    """Evaluate an indicator and return its value. Uses the precomputed series in engine when given"""
+    # Special handling for composite indicators
+    if isinstance(indicator, CompositeIndicator):
         results = []
-        for input_indicator in indicator_data['inputs']:
-            result = evaluate_indicator(input_indicator, end_date)
+        for input_indicator in indicator.inputs:
+            result = evaluate_indicator(input_indicator, end_date, plan, engine)
             if result is None:
                 return None
             results.append(result)
         return results
-    
-    # Regular indicator processing
-    if 'symbol' not in indicator_data:
-        raise ValueError(f"Indicator {name} missing required 'symbol' field")
-    
-    symbol = indicator_data['symbol']
-    
+
+    symbol = indicator.symbol
+
     # Check earliest available date
-    earliest_date = get_earliest_date(symbol)
-    if earliest_date is None or earliest_date > end_date.date():
+    if not symbol_available(plan, symbol, end_date):
         print(f"{colored('Skipping', 'red')} {colored(symbol, 'cyan')} - data not available before {colored(end_date, 'yellow')}")
         return None
-    
-    if name not in indicator_map:
-        raise ValueError(f"Indicator {name} not found")
-    
-    indicator_func = indicator_map[name]
-    print(f"Calculating: {colored(name, 'yellow')} for {colored(symbol, 'cyan')} with params {colored(params, 'green')}")
-    
-    return indicator_func(symbol, end_date, *params)
 
-def evaluate_condition(condition, end_date):
+    print(f"Calculating: {colored(indicator.name, 'yellow')} for {colored(symbol, 'cyan')} with params {colored(list(indicator.params), 'green')}")
+
+    if engine is not None:
+        return engine.value(indicator.func, symbol, indicator.params, end_date)
+    return indicator.func(symbol, end_date, *indicator.params)
+
+def evaluate_condition(node, end_date, plan, engine=None):
     """Evaluate a condition and return True or False"""
-    indicator_value = evaluate_indicator(condition['indicator'], end_date)
+    indicator_value = evaluate_indicator(node.indicator, end_date, plan, engine)
     if indicator_value is None:
         return None
-        
-    comparator = condition['comparator']
-    threshold = condition['value']
-    
+
+    comparator = node.comparator
+    threshold = node.value
+
     # Handle composite indicator results
     if isinstance(indicator_value, list):
-        if isinstance(threshold, list):
+        if isinstance(threshold, tuple):
             # Multiple thresholds for multiple values
-            if len(indicator_value) != len(threshold):
-                raise ValueError("Mismatched number of values for composite indicator comparison")
             results = []
             for val, thresh in zip(indicator_value, threshold):
                 results.append(compare_values(val, thresh, comparator))
@@ -82,112 +252,115 @@ def evaluate_condition(condition, end_date):
             for val in indicator_value:
                 results.append(compare_values(val, threshold, comparator))
             return all(results)
-        
+
     return compare_values(indicator_value, threshold, comparator)
 
 def compare_values(value, threshold, comparator):
     """Compare a single value against a threshold using the given comparator"""
     if value is None:
         return None
-        
-    ops = {
-        '>': operator.gt,
-        '<': operator.lt,
-        '>=': operator.ge,
-        '<=': operator.le,
-        '==': operator.eq,
-        '!=': operator.ne
-    }
-    
-    return ops[comparator](value, threshold)
 
-def execute_weight_action(node, end_date, transactions):
-    print(f"Executing weight action: {colored(node['weight_type'], 'green')}")
-    assets = node['assets']
-    
+    return comparators[comparator](value, threshold)
+
+def execute_weight_action(node, end_date, transactions, plan):
+    print(f"Executing weight action: {colored(node.weight_type, 'green')}")
+
     # Filter out assets that don't have data for the required period
     valid_assets = []
-    for asset in assets:
-        earliest_date = get_earliest_date(asset['symbol'])
-        if earliest_date is None or earliest_date > end_date.date():
-            print(f"{colored('Skipping', 'red')} {colored(asset['symbol'], 'cyan')} - data not available before {colored(end_date.date(), 'yellow')}")
+    for asset in node.assets:
+        if not symbol_available(plan, asset.symbol, end_date):
+            print(f"{colored('Skipping', 'red')} {colored(asset.symbol, 'cyan')} - data not available before {colored(end_date.date(), 'yellow')}")
             continue
         valid_assets.append(asset)
-    
+
     if not valid_assets:
         print(colored("No valid assets found with available data - skipping weight action", 'red'))
         return
-    
+
     # for buying
-    if node['weight_type'].endswith('buy'):
+    if node.weight_type == 'weighted_buy':
         # Recalculate weights for valid assets only
-        if node['weight_type'] == 'weighted_buy':
-            # Get total weight of valid assets
-            total_weight = sum(asset['weight'] for asset in valid_assets)
-            # Normalize weights
-            for asset in valid_assets:
-                asset['weight'] = asset['weight'] / total_weight
-            print(f"Assets: {colored({asset['symbol']: asset['weight'] for asset in valid_assets}, 'cyan')}")
-        else:
-            print(f"Assets: {colored([asset['symbol'] for asset in valid_assets], 'cyan')}")
-        
-        if node['weight_type'] == 'equal_buy':
-            return buy_equal(valid_assets, transactions)
-        elif node['weight_type'] == 'weighted_buy':
-            return buy_weighted(valid_assets, transactions)
-        else:
-            raise ValueError(f"Unknown weight type: {node['weight_type']}")
-        
-    elif node['weight_type'].endswith('sell'):
-        if node['weight_type'] == 'all_sell':
-            return sell_all(valid_assets, transactions)
-        elif node['weight_type'] == 'partial_sell':
-            return sell_partial(valid_assets, transactions)
-        else:
-            raise ValueError(f"Unknown weight type: {node['weight_type']}")
+        total_weight = sum(asset.weight for asset in valid_assets)
+        assets = [{'symbol': asset.symbol, 'weight': asset.weight / total_weight} for asset in valid_assets]
+        print(f"Assets: {colored({asset['symbol']: asset['weight'] for asset in assets}, 'cyan')}")
+        return buy_weighted(assets, transactions)
+    elif node.weight_type == 'equal_buy':
+        print(f"Assets: {colored([asset.symbol for asset in valid_assets], 'cyan')}")
+        return buy_equal([{'symbol': asset.symbol} for asset in valid_assets], transactions)
+    elif node.weight_type == 'all_sell':
+        return sell_all([{'symbol': asset.symbol} for asset in valid_assets], transactions)
+    elif node.weight_type == 'partial_sell':
+        return sell_partial([{'symbol': asset.symbol, 'percentage': asset.percentage} for asset in valid_assets], transactions)
+
+def rank_symbols(values, count, order='top'):
+    """
+    The count symbols with the highest ('top') or lowest ('bottom') values, best first.
+    values maps symbol to value in universe order. None, NaN and inf are skipped and ties
+    keep universe order.
+    """
+    ranked = [(symbol, value) for symbol, value in values.items() if value is not None and math.isfinite(value)]
+    ranked.sort(key=lambda item: -item[1] if order == 'top' else item[1])
+    return [symbol for symbol, _ in ranked[:count]]
+
+def execute_select(node, end_date, transactions, plan, engine=None):
+    name = node.requests[0].name
+    print(f"Selecting: {colored(node.order, 'green')} {node.count} of {len(node.requests)} symbols by {colored(name, 'yellow')}")
+
+    requests = [request for request in node.requests if symbol_available(plan, request.symbol, end_date)]
+    if engine is not None:
+        # one lookup over the whole universe
+        panel, valid = engine.panel(requests, [end_date])
+        values = {request.symbol: panel[0, j] if valid[0, j] else None for j, request in enumerate(requests)}
     else:
-        raise ValueError(f"Unknown weight type: {node['weight_type']}")
+        values = {request.symbol: request.func(request.symbol, end_date, *request.params) for request in requests}
 
-def process_node(node, end_date, transactions):
-    """Process a node in the decision tree"""
-    if not isinstance(node, dict):
+    selected = rank_symbols(values, node.count, node.order)
+    if not selected:
+        print(colored("No symbols with a valid indicator value - skipping select", 'red'))
         return
-        
-    node_type = node.get('type')
-    
-    if node_type == 'condition':
-        condition_result = evaluate_condition(node, end_date)
-        
+
+    print(f"Assets: {colored(selected, 'cyan')}")
+    return buy_equal([{'symbol': symbol} for symbol in selected], transactions)
+
+def process_node(node, end_date, transactions, plan, engine=None):
+    """Process a compiled node of the decision tree"""
+    if isinstance(node, ConditionNode):
+        condition_result = evaluate_condition(node, end_date, plan, engine)
+
         if condition_result:
             print(colored("Condition is True, taking true branch", 'green'))
             # Process all actions in the true branch
-            if node['if_true']:
-                for action in node['if_true']:
-                    process_node(action, end_date, transactions)
+            for action in node.if_true:
+                process_node(action, end_date, transactions, plan, engine)
         else:
             print(colored("Condition is False, taking false branch", 'red'))
             # Process all actions in the false branch
-            if node['if_false']:
-                for action in node['if_false']:
-                    process_node(action, end_date, transactions)
-                
-    elif node_type == 'weight':
-        execute_weight_action(node, end_date, transactions)
-    else:
-        raise ValueError(f"Unknown node type: {node_type}")
+            for action in node.if_false:
+                process_node(action, end_date, transactions, plan, engine)
+
+    elif isinstance(node, WeightNode):
+        execute_weight_action(node, end_date, transactions, plan)
+
+    elif isinstance(node, SelectNode):
+        execute_select(node, end_date, transactions, plan, engine)
 
-def run_trading_system(rules, end_date):
-    """Run the trading system with the given rules"""
-    print(colored(f"\nExecuting strategy: {rules['name']}", 'blue', attrs=['bold']))
+def run_trading_system(rules, end_date, engine=None):
+    """
+    Run the trading system for end_date. rules is either a rules document or a
+    CompiledStrategy, engine an optional IndicatorEngine
+    """
+    plan = rules if isinstance(rules, CompiledStrategy) else compile_rules(rules)
+
+    print(colored(f"\nExecuting strategy: {plan.name}", 'blue', attrs=['bold']))
     print(colored("=" * 50, 'blue'))
-    
+
     transactions = {
         'buy': {},
         'sell': {}
     }
 
     try:
-        process_node(rules['rules'], end_date, transactions)
+        process_node(plan.root, end_date, transactions, plan, engine)
     except Exception as e:
         print(colored(f"Error executing strategy: {str(e)}", 'red'))
         raise
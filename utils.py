@@ -1,6 +1,7 @@
 import operator
 import pandas as pd
 from indicators import *
+from trading_system import indicator_map, rank_symbols
 
 def evaluate_indicator(indicator_dict):
     if isinstance(indicator_dict, dict) and 'indicator' in indicator_dict:
@@ -34,26 +35,21 @@ def select_tickers(symbols, indicator_func, indicator_args, top_n, ascending=Fal
     Select top or bottom N tickers based on a given indicator.
     
     :param symbols: List of ticker symbols
-    :param indicator_func: Dictionary containing indicator function info
+    :param indicator_func: Dictionary with the indicator_map name under 'indicator'
     :param indicator_args: Arguments for the indicator function (excluding the symbol)
     :param top_n: Number of tickers to select
     :param ascending: If True, select bottom N. If False, select top N.
     :return: List of selected ticker symbols
     """
-    results = []
+    if not (isinstance(indicator_func, dict) and indicator_func.get('indicator') in indicator_map):
+        raise ValueError(f"Invalid indicator function: {indicator_func}")
+    func = indicator_map[indicator_func['indicator']]
+
+    values = {}
     for symbol in symbols:
         try:
-            if isinstance(indicator_func, dict) and 'indicator' in indicator_func:
-                func = globals()[indicator_func['indicator']]
-            else:
-                raise ValueError(f"Invalid indicator function: {indicator_func}")
-            
-            value = func(symbol, *indicator_args)
-            results.append((symbol, value))
+            values[symbol] = func(symbol, *indicator_args)
         except Exception as e:
             print(f"Error calculating indicator for {symbol}: {e}")
-    
-    sorted_results = sorted(results, key=lambda x: x[1], reverse=not ascending)
-    selected_tickers = [ticker for ticker, _ in sorted_results[:top_n]]
-    
-    return selected_tickers
\ No newline at end of file
+
+    return rank_symbols(values, top_n, 'bottom' if ascending else 'top')
@@ -0,0 +1,208 @@
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from termcolor import colored
+from backtesting import Portfolio
+from data_fetcher import load_daily_values
+from prefetch import prefetch
+from signals import build_signal_matrix
+from execution import FillPrices
+from trading_system import load_rules
+
+# the stats summarized across windows, in the units Portfolio.stats reports them
+DISTRIBUTION_STATS = ['CAGR', 'Max Drawdown', 'Sharpe Ratio']
+
+def rolling_windows(start_date, end_date, horizon_months, step_months=1):
+    """(start, end) of every window horizon_months long, starting every step_months from start_date and ending by end_date"""
+    windows = []
+    start = start_date
+    while start + relativedelta(months=horizon_months) <= end_date:
+        windows.append((start, start + relativedelta(months=horizon_months)))
+        start += relativedelta(months=step_months)
+    return windows
+
+def run_walk_forward(portfolio, horizon_months=60, step_months=1):
+    """
+    Backtest portfolio's strategy, money and schedules from every start month between its
+    start_date and end_date over horizon_months, and return a table of stats per window.
+
+    The signals and fill prices of every rebalance are computed once over the whole span,
+    since neither depends on when a window starts. All windows are then simulated together:
+    cash and positions are arrays with one row per window, and each rebalance updates the
+    rows of the windows it falls in with the same arithmetic Portfolio.rebalance does.
+    """
+    if portfolio.precision != 'float64':
+        raise ValueError("Walk-forward backtests run in float64 precision")
+    windows = rolling_windows(portfolio.start_date, portfolio.end_date, horizon_months, step_months)
+    if not windows:
+        raise ValueError(f"No {horizon_months} month window fits between {portfolio.start_date} and {portfolio.end_date}")
+
+    start = time.time()
+    plan = portfolio.strategy
+    for request in plan.requests:
+        portfolio.indicator_engine.series(request.func, request.symbol, request.params)
+    rebalance_dates = portfolio.rebalance_dates()
+    contribution_dates = portfolio.contribution_dates()
+    fills = FillPrices(plan.symbols, rebalance_dates, portfolio.execution)
+    rebalance_dates = [date for date in rebalance_dates if fills.fillable(date)]
+    signals = build_signal_matrix(plan, rebalance_dates, portfolio.indicator_engine)
+    print(f"Computed signals for {len(rebalance_dates)} rebalances in {time.time() - start:.2f}s")
+
+    start = time.time()
+    starts = np.array([window_start for window_start, _ in windows], dtype='datetime64[ns]')
+    ends = np.array([window_end for _, window_end in windows], dtype='datetime64[ns]')
+    event_dates, event_cash, event_shares = simulate_windows(portfolio, signals, fills, rebalance_dates, contribution_dates, starts, ends)
+    values, lengths, sessions = window_values(portfolio, signals.symbols, event_dates, event_cash, event_shares, starts, ends)
+    table = window_stats(windows, values, lengths, sessions)
+    print(colored(f"Backtested {len(windows)} windows of {horizon_months} months in {time.time() - start:.2f}s", 'green'))
+    return table
+
+def simulate_windows(portfolio, signals, fills, rebalance_dates, contribution_dates, starts, ends):
+    """
+    Run every contribution and rebalance for all windows at once. Returns the event dates
+    and the cash (events x windows) and shares (events x windows x symbols) after each,
+    where a window that hasn't started yet still holds its starting cash.
+    """
+    symbols = signals.symbols
+    columns = {symbol: i for i, symbol in enumerate(symbols)}
+    cash = np.full(len(starts), np.float64(portfolio.starting_capital))
+    shares = np.zeros((len(starts), len(symbols)))
+    slippage, commission = portfolio.slippage, portfolio.commission
+    min_cash = portfolio.min_cash
+
+    rebalances = set(rebalance_dates)
+    contributions = set(contribution_dates)
+    event_dates = sorted(rebalances | contributions)
+    event_cash = np.empty((len(event_dates), len(starts)))
+    event_shares = np.empty((len(event_dates), len(starts), len(symbols)))
+    for e, date in enumerate(event_dates):
+        day = np.datetime64(pd.Timestamp(date), 'ns')
+        active = np.flatnonzero((starts <= day) & (day <= ends))
+        if date in contributions:
+            cash[active] += portfolio.monthly_investment
+
+        if date in rebalances and len(active):
+            transactions = signals.transactions(date)
+            sells, buys = list(transactions['sell']), list(transactions['buy'])
+            prices = fills.prices(date, sells + buys)
+            sell_prices, buy_prices = prices[:len(sells)], prices[len(sells):]
+            if slippage is not None:
+                sell_prices = slippage.adjust(sell_prices, 'sell')
+                buy_prices = slippage.adjust(buy_prices, 'buy')
+
+            for symbol, price in zip(sells, sell_prices):
+                j = columns[symbol]
+                # windows that don't hold the symbol sell nothing, as Portfolio skips them
+                sold = shares[active, j] * transactions['sell'][symbol]
+                if np.isnan(price):
+                    if sold.any():
+                        raise ValueError(f"No {fills.policy} price for {[symbol]} on {date}")
+                    continue
+                proceeds = price * sold
+                if commission is not None:
+                    proceeds = np.where(sold != 0, proceeds - commission.fee(proceeds), proceeds)
+                cash[active] += proceeds
+                shares[active, j] -= sold
+
+            for symbol, price in zip(buys, buy_prices):
+                if np.isnan(price):
+                    raise ValueError(f"No {fills.policy} price for {[symbol]} on {date}")
+                j = columns[symbol]
+                budget = (cash[active] - min_cash) * transactions['buy'][symbol]
+                bought = budget / price if commission is None else commission.quantity(budget, price)
+                cost = price * bought
+                if commission is not None:
+                    cost = np.where(bought != 0, cost + commission.fee(cost), cost)
+                cash[active] -= cost
+                shares[active, j] += bought
+
+        event_cash[e] = cash
+        event_shares[e] = shares
+    return event_dates, event_cash, event_shares
+
+def window_values(portfolio, symbols, event_dates, event_cash, event_shares, starts, ends):
+    """
+    Daily value of every window over its own sessions, as a windows x sessions matrix
+    padded with NaN after each window's last session, plus each window's session count
+    and the sessions of the longest window starting from each window's first one.
+    """
+    sessions = pd.DatetimeIndex(portfolio.session_dates())
+    prices = load_daily_values(tuple(symbols), portfolio.start_date, portfolio.end_date)
+    prices = prices.reindex(index=sessions.normalize(), columns=symbols).to_numpy(dtype=np.float64)
+
+    first = sessions.searchsorted(pd.DatetimeIndex(starts), side='left')
+    last = sessions.searchsorted(pd.DatetimeIndex(ends), side='right')
+    lengths = last - first
+    rows = first[:, None] + np.arange(lengths.max())[None, :]
+    valid = rows < last[:, None]
+    rows = np.minimum(rows, len(sessions) - 1)
+
+    # the last event on or before each session; -1 before the first holds the starting cash
+    events = pd.DatetimeIndex(event_dates).searchsorted(sessions, side='right') - 1
+    event = events[rows]
+    window = np.broadcast_to(np.arange(len(starts))[:, None], rows.shape)
+    shares = np.where((event >= 0)[..., None], event_shares[np.maximum(event, 0), window], 0.0)
+    cash = np.where(event >= 0, event_cash[np.maximum(event, 0), window], np.float64(portfolio.starting_capital))
+
+    session_prices = prices[rows]
+    holdings = np.where(shares != 0, shares * session_prices, 0.0)
+    values = holdings.sum(axis=2) + cash
+    values[~valid] = np.nan
+    return values, lengths, sessions.values[rows]
+
+def window_stats(windows, values, lengths, sessions):
+    """CAGR, max drawdown and Sharpe ratio of every window, computed like Portfolio.stats"""
+    risk_free_rate = 0.02
+    daily_rf_rate = (1 + risk_free_rate) ** (1/252) - 1
+
+    index = np.arange(len(windows))
+    first_values = values[:, 0]
+    last_values = values[index, lengths - 1]
+    days = (sessions[index, lengths - 1] - sessions[:, 0]) // np.timedelta64(1, 'D')
+    cagr = (last_values / first_values) ** (252 / days) - 1
+
+    drawdowns = values / np.fmax.accumulate(values, axis=1) - 1
+    max_drawdown = np.nanmin(drawdowns, axis=1)
+    returns = values[:, 1:] / values[:, :-1] - 1
+    volatility = np.nanstd(returns, axis=1, ddof=1) * np.sqrt(252)
+
+    return pd.DataFrame({
+        'Start': [window_start.date() for window_start, _ in windows],
+        'End': [window_end.date() for _, window_end in windows],
+        'Final Value': last_values,
+        'CAGR': cagr * 100,
+        'Max Drawdown': max_drawdown * 100,
+        'Sharpe Ratio': (cagr - daily_rf_rate) / volatility,
+    })
+
+def distribution(table, percentiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """Mean, spread and percentiles of DISTRIBUTION_STATS across the windows of a walk-forward table"""
+    return table[DISTRIBUTION_STATS].describe(percentiles=list(percentiles))
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a strategy from every start month over a fixed horizon")
+    parser.add_argument('rules', help="rules file, e.g. rules.json")
+    parser.add_argument('--start', default='2012-01-01')
+    parser.add_argument('--end', default=datetime.now().strftime('%Y-%m-%d'))
+    parser.add_argument('--horizon', type=int, default=60, help="window length in months")
+    parser.add_argument('--step', type=int, default=1, help="months between window starts")
+    parser.add_argument('--capital', type=float, default=1000)
+    parser.add_argument('--monthly', type=float, default=100)
+    args = parser.parse_args()
+
+    rules = load_rules(args.rules)
+    prefetch(rules)
+    portfolio = Portfolio(
+        args.capital, args.monthly, rules,
+        datetime.strptime(args.end, "%Y-%m-%d"), datetime.strptime(args.start, "%Y-%m-%d"),
+    )
+    table = run_walk_forward(portfolio, args.horizon, args.step)
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(table)
+        print(distribution(table))
+
+if __name__ == "__main__":
+    main()